@@ -2,6 +2,8 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import logging
 from prophet import Prophet
+from sales_ingest import ingest_sales
+from weekday_profile import weekday_hour_profile, extend_until_deadstock
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -9,14 +11,12 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 #Z-016
 # Load data from D006.csv
 file_path = 'D002.csv'
-df = pd.read_csv(file_path)
-
-# Convert the 'ДАТА' column to datetime format
-df['ДАТА'] = pd.to_datetime(df['ДАТА'], format='%d.%m.%Y')
-
-# Adjust the 'HOUR' column where HOUR is 24
-df.loc[df['HOUR'] == 24, 'HOUR'] = 0
-df.loc[df['HOUR'] == 0, 'ДАТА'] = df['ДАТА'] + pd.Timedelta(days=1)
+# Parse dates and build 'ds' vectorially (HOUR 24 rolls over to 00:00 of the next day);
+# station, product and tank become categoricals, hours int8 and volumes float32
+df = ingest_sales(
+    pd.read_csv(file_path), 'ДАТА', 'HOUR', 'КОЛИЧЕСТВО',
+    key_columns=['АЗС_CODE', 'PRODNAME', 'TANKNUM'], date_format='%d.%m.%Y'
+)
 
 # Filter data for specific product and tank
 filtered_df = df[(df['PRODNAME'] == 3300000005) & (df['TANKNUM'] == 4)].copy()
@@ -26,9 +26,6 @@ if filtered_df['КОЛИЧЕСТВО'].isnull().any():
     logging.warning("Есть пустые значения в столбце 'КОЛИЧЕСТВО'. Заполняем нулями.")
     filtered_df['КОЛИЧЕСТВО'] = filtered_df['КОЛИЧЕСТВО'].fillna(0)
 
-# Create a datetime column combining date and hour
-filtered_df['ds'] = pd.to_datetime(filtered_df['ДАТА'].astype(str) + ' ' + filtered_df['HOUR'].astype(str) + ':00:00')
-
 # Generate a complete range of dates and hours
 start_date = filtered_df['ds'].min().normalize()
 end_date = filtered_df['ds'].max().normalize() + pd.Timedelta(days=1)  # Ensure the last day is included
@@ -50,18 +47,9 @@ historical_df = filtered_df[filtered_df['ds'] < '2024-09-03']
 # Prepare actual data from a specific date
 actual_df = filtered_df[(filtered_df['ds'] >= '2024-09-03') & (filtered_df['ds'] <= '2024-09-04')]
 
-# Function to find similar days and calculate rolling mean for a given weekday and hour
-def find_similar_days(target_weekday, target_hour, data, window_size=7):
-    # Increased window_size to 10 for better smoothing
-    similar_days = data[
-        (data['weekday'] == target_weekday) & 
-        (data['ds'].dt.hour == target_hour)
-    ]
-    if not similar_days.empty:
-        rolling_mean = similar_days['КОЛИЧЕСТВО'].rolling(window=window_size, min_periods=1).mean().iloc[-1]
-    else:
-        rolling_mean = 0
-    return rolling_mean
+# Rolling mean of the last 7 values for every (weekday, hour) slot, built once
+# from the history; slots without history give 0
+similar_days_profile = weekday_hour_profile(historical_df['ds'], historical_df['КОЛИЧЕСТВО'], window=7, empty=0)
 
 # Preparing data for Prophet model with tuned parameters
 prophet_df = historical_df[['ds', 'КОЛИЧЕСТВО']].rename(columns={'КОЛИЧЕСТВО': 'y'})
@@ -100,7 +88,7 @@ forecast_values = []
 for date in forecast_dates:
     target_weekday = date.weekday()
     target_hour = date.hour
-    rolling_mean_value = find_similar_days(target_weekday, target_hour, historical_df)
+    rolling_mean_value = similar_days_profile[target_weekday, target_hour]
     prophet_pred = forecast.loc[forecast['ds'] == date, 'yhat'].values[0] if not forecast.loc[forecast['ds'] == date].empty else rolling_mean_value
     
     # Weighted combination of rolling mean and Prophet predictions
@@ -117,26 +105,25 @@ forecast_df['DATE'] = forecast_df['ds'].dt.date
 # Forecast level meter and check for dead stock level
 forecast_df['уровнемер'] = initial_volume - forecast_df['yhat'].cumsum()
 dead_stock = 2929
-max_iterations = 1000
-iteration_count = 0
 
-while forecast_df['уровнемер'].iloc[-1] > dead_stock:
-    if iteration_count >= max_iterations:
-        logging.warning("Reached the maximum number of iterations. Exiting loop to prevent infinite run.")
-        break
-
-    next_date = forecast_df['ds'].iloc[-1] + pd.Timedelta(hours=1)
-    next_volume = forecast_df['уровнемер'].iloc[-1] - find_similar_days(next_date.weekday(), next_date.hour, historical_df)
-    
-    next_forecast = pd.DataFrame({
-        'ds': [next_date],
-        'yhat': [find_similar_days(next_date.weekday(), next_date.hour, historical_df)],
-        'уровнемер': [next_volume],
-        'DATE': [next_date.date()]
-    })
-    
-    forecast_df = pd.concat([forecast_df, next_forecast], ignore_index=True)
-    iteration_count += 1
+# Extend the forecast with the weekday-hour profile until the level reaches dead stock:
+# one cumulative sum and a searchsorted instead of growing the frame hour by hour.
+# The search costs the same for any horizon; the limit only bounds the rows added
+max_extension_hours = 1000
+
+if forecast_df['уровнемер'].iloc[-1] > dead_stock:
+    extension_ds, extension_yhat, extension_level, dead_stock_reached = extend_until_deadstock(
+        forecast_df['ds'].iloc[-1] + pd.Timedelta(hours=1), forecast_df['уровнемер'].iloc[-1],
+        dead_stock, similar_days_profile, max_hours=max_extension_hours
+    )
+    if not dead_stock_reached:
+        logging.warning(f"Dead stock is not reached within {max_extension_hours} extra hours.")
+    forecast_df = pd.concat([forecast_df, pd.DataFrame({
+        'ds': extension_ds,
+        'yhat': extension_yhat,
+        'уровнемер': extension_level,
+        'DATE': extension_ds.date
+    })], ignore_index=True)
 
 # Check for dead stock level
 below_dead_stock = forecast_df[forecast_df['уровнемер'] <= dead_stock]
@@ -1,10 +1,11 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 import logging
 from prophet import Prophet
 from sqlalchemy import create_engine
 import cx_Oracle
 import sys
+from sales_ingest import ingest_sales
+from weekday_profile import weekday_hour_profile, extend_until_deadstock
 
 # Инициализация Oracle Instant Client
 cx_Oracle.init_oracle_client(lib_dir=r"")
@@ -88,8 +89,17 @@ if df.empty:
 print(f"Количество полученных строк: {len(df)}")
 print(df.head())
 
-# Преобразование столбца 'ДАТА' в формат datetime
-df['ДАТА'] = pd.to_datetime(df['ДАТА'], errors='coerce')
+# Проверка на пустые значения в 'r_hour' (NULL из Oracle): такие строки нельзя
+# привести к int8, поэтому показываем их и отбрасываем
+df['r_hour'] = pd.to_numeric(df['r_hour'], errors='coerce')
+if df['r_hour'].isnull().any():
+    logging.warning("Есть пустые значения в столбце 'r_hour'. Эти строки пропускаются.")
+    print(df[df['r_hour'].isnull()])
+    df = df.dropna(subset=['r_hour'])
+
+# Преобразование 'ДАТА' в datetime и построение 'ds' без строковых преобразований:
+# час 24 переносится на 00:00 следующих суток, объём — float32, час — int8
+df = ingest_sales(df, 'ДАТА', 'r_hour', 'КОЛИЧЕСТВО')
 
 # Проверка на NaT значения в 'ДАТА'
 if df['ДАТА'].isnull().any():
@@ -97,18 +107,11 @@ if df['ДАТА'].isnull().any():
     print(df[df['ДАТА'].isnull()])
     sys.exit(1)
 
-# Корректировка столбца 'r_hour' при значении 24
-df.loc[df['r_hour'] == 24, 'r_hour'] = 0
-df.loc[df['r_hour'] == 0, 'ДАТА'] = df['ДАТА'] + pd.Timedelta(days=1)
-
 # Проверка на пропущенные значения в 'КОЛИЧЕСТВО' и заполнение нулями
 if df['КОЛИЧЕСТВО'].isnull().any():
     logging.warning("Есть пустые значения в столбце 'КОЛИЧЕСТВО'. Заполняем нулями.")
     df['КОЛИЧЕСТВО'] = df['КОЛИЧЕСТВО'].fillna(0)
 
-# Создание столбца 'ds' с комбинацией даты и часа
-df['ds'] = pd.to_datetime(df['ДАТА'].dt.strftime('%Y-%m-%d') + ' ' + df['r_hour'].astype(str) + ':00:00')
-
 # Генерация полного диапазона дат и часов
 start_date = df['ds'].min().normalize()
 end_date = df['ds'].max().normalize() + pd.Timedelta(days=1)  # Включение последнего дня
@@ -133,17 +136,9 @@ historical_df = df[df['ds'] < '2024-09-08']
 # Подготовка фактических данных с определенной даты
 actual_df = df[(df['ds'] >= '2024-09-08') & (df['ds'] <= '2024-09-09')]
 
-# Функция для поиска похожих дней и расчета скользящего среднего
-def find_similar_days(target_weekday, target_hour, data, window_size=7):
-    similar_days = data[
-        (data['weekday'] == target_weekday) & 
-        (data['ds'].dt.hour == target_hour)
-    ]
-    if not similar_days.empty:
-        rolling_mean = similar_days['КОЛИЧЕСТВО'].rolling(window=window_size, min_periods=1).mean().iloc[-1]
-    else:
-        rolling_mean = 0
-    return rolling_mean
+# Скользящее среднее последних 7 значений для всех слотов (день недели, час),
+# посчитанное один раз по истории; слоты без истории дают 0
+similar_days_profile = weekday_hour_profile(historical_df['ds'], historical_df['КОЛИЧЕСТВО'], window=7, empty=0)
 
 # Подготовка данных для модели Prophet
 prophet_df = historical_df[['ds', 'КОЛИЧЕСТВО']].rename(columns={'КОЛИЧЕСТВО': 'y'})
@@ -182,7 +177,7 @@ forecast_values = []
 for date in forecast_dates:
     target_weekday = date.weekday()
     target_hour = date.hour
-    rolling_mean_value = find_similar_days(target_weekday, target_hour, historical_df)
+    rolling_mean_value = similar_days_profile[target_weekday, target_hour]
     prophet_pred_series = forecast.loc[forecast['ds'] == date, 'yhat']
     if not prophet_pred_series.empty:
         prophet_pred = prophet_pred_series.values[0]
@@ -203,29 +198,25 @@ forecast_df['DATE'] = forecast_df['ds'].dt.date
 # Прогноз уровня и проверка на достижение мертвого остатка
 forecast_df['уровнемер'] = initial_volume - forecast_df['yhat'].cumsum()
 dead_stock = 3171   
-max_iterations = 1000
-iteration_count = 0
-
-while forecast_df['уровнемер'].iloc[-1] > dead_stock:
-    if iteration_count >= max_iterations:
-        logging.warning("Достигнуто максимальное количество итераций. Прерываем цикл, чтобы избежать бесконечного выполнения.")
-        break
-
-    next_date = forecast_df['ds'].iloc[-1] + pd.Timedelta(hours=1)
-    target_weekday = next_date.weekday()
-    target_hour = next_date.hour
-    next_volume_consumption = find_similar_days(target_weekday, target_hour, historical_df)
-    next_volume = forecast_df['уровнемер'].iloc[-1] - next_volume_consumption
-
-    next_forecast = pd.DataFrame({
-        'ds': [next_date],
-        'yhat': [next_volume_consumption],
-        'уровнемер': [next_volume],
-        'DATE': [next_date.date()]
-    })
-
-    forecast_df = pd.concat([forecast_df, next_forecast], ignore_index=True)
-    iteration_count += 1
+
+# Продление прогноза по профилю (день недели, час) до мертвого остатка: одна накопленная
+# сумма и searchsorted вместо наращивания таблицы по часу. Поиск стоит одинаково при любом
+# горизонте, предел ограничивает только число добавляемых строк
+max_extension_hours = 1000
+
+if forecast_df['уровнемер'].iloc[-1] > dead_stock:
+    extension_ds, extension_yhat, extension_level, dead_stock_reached = extend_until_deadstock(
+        forecast_df['ds'].iloc[-1] + pd.Timedelta(hours=1), forecast_df['уровнемер'].iloc[-1],
+        dead_stock, similar_days_profile, max_hours=max_extension_hours
+    )
+    if not dead_stock_reached:
+        logging.warning(f"Мертвый остаток не достигнут за {max_extension_hours} часов продления.")
+    forecast_df = pd.concat([forecast_df, pd.DataFrame({
+        'ds': extension_ds,
+        'yhat': extension_yhat,
+        'уровнемер': extension_level,
+        'DATE': extension_ds.date
+    })], ignore_index=True)
 
 # Проверка на достижение мертвого остатка
 below_dead_stock = forecast_df[forecast_df['уровнемер'] <= dead_stock]
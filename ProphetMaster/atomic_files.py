@@ -0,0 +1,54 @@
+# Атомарная запись и чтение с восстановлением служебных файлов кэшей (JSON-манифесты, Parquet)
+import os
+import json
+import logging
+
+import pandas as pd
+
+
+def replace_atomically(path, write):
+    """
+    Записывает файл через временный path + '.tmp' и os.replace: прерванная запись
+    не оставляет на месте path наполовину записанный файл.
+    write(tmp_path) создаёт содержимое.
+    """
+    tmp_path = path + '.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_json(path, data):
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    replace_atomically(path, write)
+
+
+def write_parquet(path, df):
+    replace_atomically(path, lambda tmp_path: df.to_parquet(tmp_path, index=False))
+
+
+def read_json(path, recovery):
+    """
+    Содержимое JSON-файла или {}, если файла нет или он не читается.
+    recovery — что будет сделано вместо чтения (для предупреждения в лог).
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.warning(f"Не удалось прочитать {path}, {recovery}: {e}")
+        return {}
+
+
+def read_parquet(path, recovery):
+    """DataFrame из Parquet-файла или None, если файла нет или он не читается"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path)
+    except Exception as e:
+        logging.warning(f"Не удалось прочитать {path}, {recovery}: {e}")
+        return None
@@ -0,0 +1,231 @@
+# Ленивое подключение с экспоненциальной задержкой, джиттером и автоматическим выключателем
+import time
+import random
+import logging
+import threading
+
+
+class CircuitOpenError(Exception):
+    """Выключатель разомкнут: база недавно падала подряд, запросы не отправляются"""
+
+
+class ConnectionManager:
+    """
+    Держит движок базы и создаёт его только при первом обращении к engine.
+    Повторы идут с экспоненциальной задержкой base_delay * 2^n (не больше max_delay)
+    и случайным джиттером, а не фиксированными десятками секунд.
+    После failure_threshold неудач подряд выключатель размыкается на reset_timeout
+    секунд: вызовы сразу получают CircuitOpenError, затем одна пробная попытка
+    (полуоткрытое состояние) решает, замкнуть его снова или нет; пока она идёт,
+    остальные вызовы тоже получают CircuitOpenError. Ошибки одного движка
+    считаются один раз: сбой сети, который видят все параллельные запросы, — одна неудача.
+    Живость подключений проверяет сам пул (pool_pre_ping или SELECT 1 в PyodbcPool),
+    поэтому движок пересоздаётся только после реальной ошибки, а не на каждом повторе.
+    """
+
+    def __init__(self, name, factory, max_retries=5, base_delay=1.0, max_delay=30.0,
+                 failure_threshold=3, reset_timeout=60.0):
+        self.name = name
+        self.factory = factory
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._engine = None
+        self._lock = threading.Lock()
+        # Движок создаёт один поток за раз; номер попытки создания и её ошибка
+        # нужны потокам, которые ждали на блокировке, чтобы не повторять и не считать её
+        self._create_lock = threading.Lock()
+        self._create_attempt = 0
+        self._create_error = None
+        self._failures = 0
+        self._failed_engine = None
+        self._opened_at = None
+        # Поток пробной попытки полуоткрытого состояния и время её начала
+        self._trial_owner = None
+        self._trial_started = None
+
+    #######################################################################
+    # Выключатель
+    #######################################################################
+    def _trial_in_flight(self):
+        """Идёт ли чужая пробная попытка; зависшая дольше reset_timeout не считается"""
+        if self._trial_owner is None or self._trial_owner == threading.get_ident():
+            return False
+        return time.monotonic() - self._trial_started < self.reset_timeout
+
+    def _end_trial(self, any_thread=False):
+        """Снимает пробную попытку текущего потока (any_thread — любого); True, если её вёл он"""
+        own = self._trial_owner == threading.get_ident()
+        if own or any_thread:
+            self._trial_owner = None
+            self._trial_started = None
+        return own
+
+    def check_circuit(self):
+        """Бросает CircuitOpenError, пока выключатель разомкнут или идёт чужая пробная попытка"""
+        with self._lock:
+            if self._trial_in_flight():
+                raise CircuitOpenError(f"{self.name}: идёт пробная попытка после размыкания выключателя")
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(f"{self.name}: выключатель разомкнут, повтор через {remaining:.0f} с")
+            # Полуоткрытое состояние: пропускаем одну пробную попытку (этого потока)
+            # до её record_success или record_failure
+            self._opened_at = None
+            self._failures = self.failure_threshold - 1
+            self._trial_owner = threading.get_ident()
+            self._trial_started = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._failed_engine = None
+            self._opened_at = None
+            # Успешный запрос любого потока означает, что база снова доступна
+            self._end_trial(any_thread=True)
+
+    def wait_circuit(self):
+        """Ждёт перехода разомкнутого выключателя в полуоткрытое состояние или итога пробной попытки"""
+        with self._lock:
+            remaining = 0 if self._opened_at is None else self.reset_timeout - (time.monotonic() - self._opened_at)
+            trial = self._trial_in_flight()
+        if remaining > 0:
+            print(f"⏸ {self.name}: выключатель разомкнут, ожидание {remaining:.0f} с...")
+            time.sleep(remaining + random.uniform(0, self.base_delay))
+        elif trial:
+            time.sleep(self.base_delay * random.uniform(0.5, 1.5))
+
+    def record_failure(self, error, engine=None):
+        """
+        Учитывает неудачу; повторная ошибка на том же движке engine не считается.
+        Неудача пробной попытки считается всегда и снова размыкает выключатель
+        """
+        with self._lock:
+            trial = self._end_trial()
+            if engine is not None:
+                if engine is self._failed_engine and not trial:
+                    return
+                self._failed_engine = engine
+            self._failures += 1
+            if self._failures >= self.failure_threshold and self._opened_at is None:
+                self._opened_at = time.monotonic()
+                logging.error(f"{self.name}: {self._failures} ошибок подряд, выключатель разомкнут на {self.reset_timeout:.0f} с: {error}")
+
+    def backoff(self, attempt):
+        """Пауза перед повтором номер attempt (с нуля): экспонента с джиттером"""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay *= random.uniform(0.5, 1.5)
+        print(f"⏳ Ожидание {delay:.1f} с перед повтором...")
+        time.sleep(delay)
+
+    #######################################################################
+    # Движок
+    #######################################################################
+    @property
+    def engine(self):
+        """
+        Движок; создаётся при первом обращении (одна попытка — повторы делает run).
+        Одновременные обращения ждут одного создания: при его неудаче они получают
+        ту же ошибку, и она считается выключателем один раз
+        """
+        engine = self._engine
+        if engine is not None:
+            return engine
+        attempt = self._create_attempt
+        with self._create_lock:
+            if self._engine is not None:
+                return self._engine
+            if self._create_attempt != attempt and self._create_error is not None:
+                # Пока ждали, другой поток уже попытался подключиться и не смог
+                raise self._create_error
+            self.check_circuit()
+            try:
+                engine = self.factory()
+            except Exception as e:
+                self._create_error = e
+                self.record_failure(e)
+                raise
+            finally:
+                # Номер меняется по завершении: пришедшие во время создания увидят его итог
+                self._create_attempt += 1
+            self._create_error = None
+            with self._lock:
+                self._engine = engine
+            return engine
+
+    @property
+    def connected(self):
+        return self._engine is not None
+
+    def invalidate(self, engine=None):
+        """
+        Сбрасывает движок после ошибки подключения; новый создастся при следующем обращении.
+        engine — движок, на котором случилась ошибка: если другой поток уже пересоздал его,
+        новый движок не трогаем. Выданные подключения dispose не закрывает (и SQLAlchemy,
+        и PyodbcPool закрывают их при возврате), поэтому чтения других потоков доработают.
+        """
+        with self._lock:
+            if engine is not None and self._engine is not engine:
+                return
+            engine, self._engine = self._engine, None
+        if engine is not None and hasattr(engine, 'dispose'):
+            try:
+                engine.dispose()
+            except Exception as e:
+                logging.warning(f"{self.name}: ошибка при закрытии движка: {e}")
+
+    def run(self, func, max_retries=None, description="запрос", wait_for_circuit=False):
+        """
+        Выполняет func(engine) с повторами; после ошибки движок пересоздаётся лениво.
+        wait_for_circuit=True — при разомкнутом выключателе ждать и повторять, не тратя
+        попытку, вместо CircuitOpenError (для параллельных партиций одной выгрузки)
+        """
+        # Итератор дочитывается до конца, чтобы run_iter успел вызвать record_success
+        results = list(self.run_iter(lambda engine: [func(engine)], max_retries, description, wait_for_circuit))
+        return results[0]
+
+    def run_iter(self, func, max_retries=None, description="запрос", wait_for_circuit=False, finished=None):
+        """
+        Потоковый run: func(engine) возвращает итератор, элементы отдаются по мере чтения.
+        После сбоя func вызывается снова на новом движке — продолжить с места сбоя
+        (например, запросить только ещё не отданные строки) должна сама func.
+        finished() проверяется после сбоя: True — всё уже отдано, повтор не нужен.
+        """
+        max_retries = max_retries or self.max_retries
+        attempt = 0
+        while True:
+            engine = None
+            try:
+                self.check_circuit()
+                print(f"🔄 {self.name}: {description}... (попытка {attempt + 1}/{max_retries})")
+                engine = self.engine
+                yield from func(engine)
+                self.record_success()
+                return
+            except CircuitOpenError as e:
+                if not wait_for_circuit:
+                    raise
+                print(f"⏸ {e}")
+                self.wait_circuit()
+            except Exception as e:
+                # Ошибку создания движка уже учло свойство engine; сбой одного движка
+                # в нескольких потоках считается одной неудачей
+                if engine is not None:
+                    self.record_failure(e, engine)
+                print(f"❌ Попытка {attempt + 1} не удалась: {e}")
+                if finished is not None and finished():
+                    return
+                attempt += 1
+                if attempt == max_retries:
+                    print("💥 Все попытки исчерпаны!")
+                    raise
+                if engine is not None:
+                    self.invalidate(engine)
+                self.backoff(attempt - 1)
+
+    def close(self):
+        self.invalidate()
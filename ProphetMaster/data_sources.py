@@ -0,0 +1,377 @@
+# Слой источников данных: общий интерфейс и локальная реализация на SQLite/Parquet
+#
+# Локальный источник повторяет таблицы боевых баз:
+#   sqlserver.sqlite -> ord_salesbyhour, ord_forecast          (SQL Server)
+#   gs.sqlite        -> GS.AZS            (подключается как схема GS, Oracle)
+#   bi.sqlite        -> BI.tigmeasurements (подключается как схема BI, Oracle)
+#
+# Запуск:
+#   python data_sources.py synthetic [папка] [csv]   - синтетические данные + deadstock CSV
+#   python data_sources.py import <папка_parquet> [папка]  - записанные выгрузки в Parquet
+import os
+import sys
+import sqlite3
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from sales_history import normalize_sales_frame, split_by_key
+
+LOCAL_DATA_DIR = 'local_data'
+DEADSTOCK_CSV_NAME = 'deadstock_info_new.csv'
+
+# Таблица -> (файл базы, имя схемы при ATTACH или None)
+LOCAL_TABLES = {
+    'ord_salesbyhour': ('sqlserver.sqlite', None),
+    'ord_forecast': ('sqlserver.sqlite', None),
+    'GS.AZS': ('gs.sqlite', 'GS'),
+    'BI.tigmeasurements': ('bi.sqlite', 'BI'),
+}
+
+LOCAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ord_salesbyhour (
+    r_day TEXT, r_hour INTEGER, objectcode TEXT, gasnum TEXT, tank INTEGER, RECEIPTS_VOLUME REAL
+);
+CREATE INDEX IF NOT EXISTS ix_salesbyhour_key ON ord_salesbyhour (objectcode, gasnum, tank, r_day);
+CREATE TABLE IF NOT EXISTS ord_forecast (
+    objectcode TEXT, gasnum TEXT, tank INTEGER, date_time TEXT,
+    forecast_volume_sales REAL, date_time_deadstock TEXT, forecast_current_volume REAL
+);
+CREATE TABLE IF NOT EXISTS GS.AZS (OBJECTCODE TEXT, STATUS INTEGER);
+CREATE TABLE IF NOT EXISTS BI.tigmeasurements (
+    ID INTEGER PRIMARY KEY, OBJECTCODE TEXT, TANK INTEGER, GASNUM TEXT, VOLUME REAL, POSTIMESTAMP TEXT
+);
+CREATE INDEX IF NOT EXISTS BI.ix_tig_time ON tigmeasurements (POSTIMESTAMP);
+"""
+
+
+class DataSource:
+    """
+    Интерфейс источника данных прогноза. Ключ комбинации везде (OBJECTCODE, GASNUM, TANK).
+    Боевая реализация (SQL Server + Oracle) находится в main.py, локальная — ниже.
+    """
+    name = 'base'
+
+    def read_station_statuses(self, object_codes):
+        """DataFrame [OBJECTCODE, STATUS] из GS.AZS"""
+        raise NotImplementedError
+
+    def iter_sales(self, keys, since=None):
+        """Пары (ключ, строки ord_salesbyhour) по комбинациям keys, начиная с даты since"""
+        raise NotImplementedError
+
+    def read_current_volumes(self, keys, forecast_date):
+        """DataFrame [OBJECTCODE, TANK, GASNUM, VOLUME] — последние замеры за день прогноза"""
+        raise NotImplementedError
+
+    def read_fallback_volumes(self, keys, forecast_date):
+        """DataFrame [OBJECTCODE, TANK, GASNUM, VOLUME] — средний объём за 30 дней до даты прогноза"""
+        raise NotImplementedError
+
+    def read_measurements(self, object_codes, start, end, after_id=None):
+        """Строки BI.tigmeasurements по АЗС object_codes с POSTIMESTAMP в [start, end) и ID > after_id"""
+        raise NotImplementedError
+
+    def delete_forecasts(self, keys, start, end):
+        """Удаляет прогнозы комбинаций keys в интервале [start, end], возвращает число строк"""
+        raise NotImplementedError
+
+    def insert_forecasts(self, df):
+        """Добавляет строки прогноза в ord_forecast"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LocalDataSource(DataSource):
+    """Локальные копии ord_salesbyhour, ord_forecast, GS.AZS и BI.tigmeasurements в SQLite"""
+    name = 'local'
+
+    def __init__(self, base_dir=LOCAL_DATA_DIR, aggregate=True, history_start_for=None):
+        self.base_dir = base_dir
+        self.aggregate = aggregate
+        self.history_start_for = history_start_for
+        os.makedirs(self.base_dir, exist_ok=True)
+        with self.session() as conn:
+            conn.executescript(LOCAL_SCHEMA)
+
+    def connect(self):
+        """Новое подключение на каждый вызов: SQLite-подключения нельзя делить между потоками"""
+        conn = sqlite3.connect(os.path.join(self.base_dir, 'sqlserver.sqlite'))
+        conn.execute(f"ATTACH DATABASE '{os.path.join(self.base_dir, 'gs.sqlite')}' AS GS")
+        conn.execute(f"ATTACH DATABASE '{os.path.join(self.base_dir, 'bi.sqlite')}' AS BI")
+        return conn
+
+    @contextmanager
+    def session(self):
+        """Подключение с фиксацией изменений и закрытием по завершении блока"""
+        conn = self.connect()
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _load_keys(self, conn, keys):
+        """Временная таблица с точными комбинациями (аналог JOIN (VALUES ...) в SQL Server)"""
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS k (objectcode TEXT, gasnum TEXT, tank INTEGER, history_start TEXT)"
+        )
+        conn.execute("DELETE FROM k")
+        rows = []
+        for object_code, gasnum, tank in keys:
+            history_start = self.history_start_for(gasnum) if self.history_start_for else None
+            # На день раньше, как keys_table_rows в main.py: час 24 накануне — полночь первого дня
+            start = history_start - pd.Timedelta(days=1) if history_start is not None else None
+            start_str = start.strftime('%Y-%m-%d') if start is not None else '1900-01-01'
+            rows.append((str(object_code), str(gasnum), int(tank), start_str))
+        conn.executemany("INSERT INTO k VALUES (?, ?, ?, ?)", rows)
+
+    #######################################################################
+    # Чтение
+    #######################################################################
+    def read_station_statuses(self, object_codes):
+        placeholders = ','.join('?' for _ in object_codes)
+        with self.session() as conn:
+            return pd.read_sql_query(
+                f"SELECT OBJECTCODE, STATUS FROM GS.AZS WHERE OBJECTCODE IN ({placeholders})",
+                conn,
+                params=[str(code) for code in object_codes]
+            )
+
+    def iter_sales(self, keys, since=None):
+        if self.aggregate:
+            # Та же агрегация и перенос часа 24, что и в SALES_HOURLY_SQL (main.py)
+            query = """
+            SELECT h.DATE, h.R_HOUR, h.OBJECTCODE, h.GASNUM, h.TANK, SUM(h.RECEIPTS_VOLUME) AS RECEIPTS_VOLUME
+            FROM (
+                SELECT
+                    CASE WHEN s.r_hour IN (0, 24) THEN date(s.r_day, '+1 day') ELSE date(s.r_day) END AS DATE,
+                    s.r_hour % 24 AS R_HOUR,
+                    s.objectcode AS OBJECTCODE,
+                    s.gasnum AS GASNUM,
+                    s.tank AS TANK,
+                    IFNULL(s.RECEIPTS_VOLUME, 0) AS RECEIPTS_VOLUME
+                FROM ord_salesbyhour s
+                JOIN k ON s.objectcode = k.objectcode AND s.gasnum = k.gasnum AND s.tank = k.tank
+                WHERE s.r_day >= k.history_start
+            ) h
+            WHERE h.DATE >= :since
+            GROUP BY h.DATE, h.R_HOUR, h.OBJECTCODE, h.GASNUM, h.TANK
+            ORDER BY h.OBJECTCODE, h.GASNUM, h.TANK, h.DATE, h.R_HOUR
+            """
+        else:
+            query = """
+            SELECT
+                date(s.r_day) AS DATE,
+                s.r_hour AS R_HOUR,
+                s.objectcode AS OBJECTCODE,
+                s.gasnum AS GASNUM,
+                s.tank AS TANK,
+                IFNULL(s.RECEIPTS_VOLUME, 0) AS RECEIPTS_VOLUME
+            FROM ord_salesbyhour s
+            JOIN k ON s.objectcode = k.objectcode AND s.gasnum = k.gasnum AND s.tank = k.tank
+            WHERE s.r_day >= k.history_start AND s.r_day >= :since
+            ORDER BY s.objectcode, s.gasnum, s.tank, s.r_day, s.r_hour
+            """
+        since_str = since.strftime('%Y-%m-%d') if since is not None else '1900-01-01'
+        with self.session() as conn:
+            self._load_keys(conn, keys)
+            df = pd.read_sql_query(query, conn, params={'since': since_str})
+        return split_by_key(normalize_sales_frame(df))
+
+    def read_current_volumes(self, keys, forecast_date):
+        query = """
+        SELECT t.OBJECTCODE, t.TANK, t.GASNUM, t.VOLUME
+        FROM BI.tigmeasurements t
+        JOIN k ON t.OBJECTCODE = k.objectcode AND t.GASNUM = k.gasnum AND t.TANK = k.tank
+        WHERE t.ID IN (
+            SELECT MAX(ID)
+            FROM BI.tigmeasurements
+            WHERE POSTIMESTAMP >= :day_start AND POSTIMESTAMP < :day_end
+            GROUP BY OBJECTCODE, TANK, GASNUM
+        )
+        """
+        day_start = pd.Timestamp(forecast_date)
+        with self.session() as conn:
+            self._load_keys(conn, keys)
+            return pd.read_sql_query(query, conn, params={
+                'day_start': day_start.strftime('%Y-%m-%d %H:%M:%S'),
+                'day_end': (day_start + pd.Timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S'),
+            })
+
+    def read_fallback_volumes(self, keys, forecast_date):
+        query = """
+        SELECT t.OBJECTCODE, t.TANK, t.GASNUM, AVG(t.VOLUME) AS VOLUME
+        FROM BI.tigmeasurements t
+        JOIN k ON t.OBJECTCODE = k.objectcode AND t.GASNUM = k.gasnum AND t.TANK = k.tank
+        WHERE t.POSTIMESTAMP >= :start AND t.POSTIMESTAMP < :end
+        GROUP BY t.OBJECTCODE, t.TANK, t.GASNUM
+        """
+        day_start = pd.Timestamp(forecast_date)
+        with self.session() as conn:
+            self._load_keys(conn, keys)
+            return pd.read_sql_query(query, conn, params={
+                'start': (day_start - pd.Timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S'),
+                'end': (day_start + pd.Timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S'),
+            })
+
+    def read_measurements(self, object_codes, start, end, after_id=None):
+        placeholders = ','.join('?' for _ in object_codes)
+        query = f"""
+        SELECT ID, OBJECTCODE, TANK, GASNUM, VOLUME, POSTIMESTAMP
+        FROM BI.tigmeasurements
+        WHERE POSTIMESTAMP >= ? AND POSTIMESTAMP < ?
+          AND ID > ?
+          AND OBJECTCODE IN ({placeholders})
+        """
+        params = [
+            pd.Timestamp(start).strftime('%Y-%m-%d %H:%M:%S'),
+            pd.Timestamp(end).strftime('%Y-%m-%d %H:%M:%S'),
+            after_id if after_id is not None else -1,
+        ] + [str(code) for code in object_codes]
+        with self.session() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    #######################################################################
+    # Запись
+    #######################################################################
+    def delete_forecasts(self, keys, start, end):
+        with self.session() as conn:
+            self._load_keys(conn, keys)
+            cursor = conn.execute(
+                """
+                DELETE FROM ord_forecast
+                WHERE date_time BETWEEN ? AND ?
+                  AND EXISTS (
+                      SELECT 1 FROM k
+                      WHERE k.objectcode = ord_forecast.objectcode
+                        AND k.gasnum = ord_forecast.gasnum
+                        AND k.tank = ord_forecast.tank
+                  )
+                """,
+                (str(start), str(end))
+            )
+            return cursor.rowcount
+
+    def insert_forecasts(self, df):
+        df = df.copy()
+        for column in ('date_time', 'date_time_deadstock'):
+            df[column] = pd.to_datetime(df[column]).dt.strftime('%Y-%m-%d %H:%M:%S')
+        with self.session() as conn:
+            df.to_sql('ord_forecast', conn, if_exists='append', index=False)
+
+    #######################################################################
+    # Наполнение
+    #######################################################################
+    def replace_table(self, table, df):
+        """Перезаписывает содержимое таблицы (например, из записанной выгрузки)"""
+        with self.session() as conn:
+            conn.execute(f"DELETE FROM {table}")
+            placeholders = ','.join('?' for _ in df.columns)
+            conn.executemany(
+                f"INSERT INTO {table} ({','.join(df.columns)}) VALUES ({placeholders})",
+                df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+            )
+
+    def import_parquet(self, parquet_dir):
+        """Загружает выгрузки <таблица>.parquet (например, GS.AZS.parquet) в локальные базы"""
+        for table in LOCAL_TABLES:
+            path = os.path.join(parquet_dir, f"{table}.parquet")
+            if not os.path.exists(path):
+                continue
+            df = pd.read_parquet(path)
+            for column in df.columns:
+                if pd.api.types.is_datetime64_any_dtype(df[column]):
+                    df[column] = df[column].dt.strftime('%Y-%m-%d %H:%M:%S')
+            self.replace_table(table, df)
+            print(f"✅ {table}: загружено {len(df):,} строк из {path}")
+
+
+#######################################################################
+# Синтетические данные
+#######################################################################
+SYNTHETIC_FUELS = [('АИ-92', '3300000002'), ('АИ-95', '3300000005'), ('ДТ', '3300000010')]
+
+
+def create_synthetic_data(base_dir=LOCAL_DATA_DIR, deadstock_csv=None,
+                          stations=20, days=120, end_date=None, seed=42):
+    """
+    Генерирует правдоподобные часовые продажи с недельной и суточной сезонностью,
+    замеры уровнемеров и CSV с мёртвыми остатками для stations АЗС.
+    """
+    rng = np.random.default_rng(seed)
+    deadstock_csv = deadstock_csv or os.path.join(base_dir, DEADSTOCK_CSV_NAME)
+    end_date = pd.Timestamp(end_date or datetime.now().date())
+    start_date = end_date - pd.Timedelta(days=days)
+    source = LocalDataSource(base_dir)
+
+    hours = pd.date_range(start_date, end_date - pd.Timedelta(hours=1), freq='h')
+    daily_profile = 0.4 + np.sin(np.pi * np.clip(hours.hour - 6, 0, 16) / 16)
+    weekly_profile = np.where(hours.weekday >= 5, 1.2, 1.0)
+
+    sales, tanks_csv, statuses, measurements = [], [], [], []
+    measurement_id = 1
+    for s in range(stations):
+        object_code = f"Z{s + 1:03d}"
+        city, branch = ("Астана", "Астана") if s % 2 == 0 else ("Усть-Каменогорск", "ВКО")
+        statuses.append((object_code, 1))
+        for tank, (fuel_name, gasnum) in enumerate(SYNTHETIC_FUELS, start=1):
+            base = rng.uniform(40, 160)
+            volume = rng.gamma(4.0, base / 4.0, len(hours)) * daily_profile * weekly_profile
+            # r_hour в ord_salesbyhour идёт от 1 до 24: час 0 записан как 24 предыдущего дня
+            r_hour = np.where(hours.hour == 0, 24, hours.hour)
+            r_day = np.where(hours.hour == 0, hours - pd.Timedelta(days=1), hours).astype('datetime64[D]')
+            sales.append(pd.DataFrame({
+                'r_day': pd.to_datetime(r_day).strftime('%Y-%m-%d'),
+                'r_hour': r_hour,
+                'objectcode': object_code,
+                'gasnum': gasnum,
+                'tank': tank,
+                'RECEIPTS_VOLUME': volume.round(2),
+            }))
+
+            max_volume = int(rng.choice([20000, 30000, 40000]))
+            dead_volume = int(max_volume * 0.1)
+            tanks_csv.append({
+                'Gas_Station_Name': f"АЗС {object_code}", 'City': city, 'Branch': branch,
+                'ObjectCode': object_code, 'Tank_Number': f"Резервуар {tank} {fuel_name}",
+                'Deadstock_Level': 15, 'Deadstock_Volume': dead_volume,
+                'Max_Level': 250, 'Max_Volume': max_volume,
+            })
+
+            # Замеры уровнемеров раз в час за последние 30 дней, включая сам end_date
+            level = max_volume * 0.8
+            for ts in pd.date_range(end_date - pd.Timedelta(days=30), end_date + pd.Timedelta(hours=6), freq='h'):
+                level -= rng.uniform(0, base)
+                if level < dead_volume * 2:
+                    level = max_volume * 0.9
+                measurements.append((measurement_id, object_code, tank, gasnum, round(level, 1),
+                                     ts.strftime('%Y-%m-%d %H:%M:%S')))
+                measurement_id += 1
+
+    source.replace_table('ord_salesbyhour', pd.concat(sales, ignore_index=True))
+    source.replace_table('GS.AZS', pd.DataFrame(statuses, columns=['OBJECTCODE', 'STATUS']))
+    source.replace_table('BI.tigmeasurements', pd.DataFrame(
+        measurements, columns=['ID', 'OBJECTCODE', 'TANK', 'GASNUM', 'VOLUME', 'POSTIMESTAMP']))
+    pd.DataFrame(tanks_csv).to_csv(deadstock_csv, index=False)
+    print(f"✅ Синтетические данные: {stations} АЗС, {len(tanks_csv)} резервуаров, {len(hours)} часов -> {base_dir}, {deadstock_csv}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else 'synthetic'
+    if command == 'synthetic':
+        create_synthetic_data(
+            sys.argv[2] if len(sys.argv) > 2 else LOCAL_DATA_DIR,
+            sys.argv[3] if len(sys.argv) > 3 else None
+        )
+    elif command == 'import' and len(sys.argv) > 2:
+        LocalDataSource(sys.argv[3] if len(sys.argv) > 3 else LOCAL_DATA_DIR).import_parquet(sys.argv[2])
+    else:
+        print("Использование: python data_sources.py synthetic [папка] [csv] | import <папка_parquet> [папка]")
+        sys.exit(1)
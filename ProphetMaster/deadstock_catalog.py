@@ -0,0 +1,139 @@
+# Каталог мёртвых остатков (deadstock_info_new.csv) с разобранными TANK и FuelType и кэшем разбора
+import os
+import re
+import hashlib
+import logging
+from datetime import datetime
+
+import pandas as pd
+
+from atomic_files import read_json, read_parquet, write_json, write_parquet
+
+CATALOG_NAME = 'catalog.parquet'
+MANIFEST_NAME = 'catalog.json'
+# Меняется вместе с шаблонами разбора или переименованием колонок — старый кэш тогда не подходит
+CATALOG_FORMAT = 1
+
+# Переименование столбцов CSV в имена, с которыми работает main.py
+CATALOG_COLUMNS = {
+    'Gas_Station_Name': 'Gas_Station_Name',
+    'City': 'City',
+    'Branch': 'Branch',
+    'ObjectCode': 'OBJECTCODE',
+    'Tank_Number': 'Tank_Number',
+    'Deadstock_Level': 'Level_cm',
+    'Deadstock_Volume': 'Volume_liters',
+    'Max_Level': 'Max_Level',
+    'Max_Volume': 'Max_Volume'
+}
+
+# "Резервуар + число" и тип топлива в Tank_Number
+TANK_PATTERN = re.compile(r'Резервуар[ау]?\s*(\d+)', re.IGNORECASE)
+FUEL_PATTERN = re.compile(
+    r'(АИ-80|АИ-92|АИ-95|АИ-98|ДТ-З-32|ДТ-З-25|ДТ-Л|ДТЗ|ДТ|СУГ|АИ-95-IMPORT)',
+    re.IGNORECASE
+)
+
+
+def parse_tanks(tank_values):
+    """
+    Колонки TANK (Int64) и FuelType для всего столбца Tank_Number: str.extract
+    с заранее скомпилированными шаблонами вместо двух re.search и pd.Series на строку.
+    Где номер или топливо не найдены — NA.
+    """
+    text = tank_values.astype(str)
+    tank = pd.to_numeric(text.str.extract(TANK_PATTERN, expand=False)).astype('Int64')
+    fuel = text.str.extract(FUEL_PATTERN, expand=False).str.upper()
+    return pd.DataFrame({'TANK': tank, 'FuelType': fuel}, index=tank_values.index)
+
+
+def read_catalog(csv_path):
+    """CSV с мёртвыми остатками с переименованными колонками и разобранными TANK, FuelType"""
+    catalog = pd.read_csv(csv_path).rename(columns=CATALOG_COLUMNS)
+    catalog[['TANK', 'FuelType']] = parse_tanks(catalog['Tank_Number'])
+    return catalog
+
+
+def file_sha256(path):
+    """SHA-256 содержимого файла, читаемого блоками по 1 МБ"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DeadstockCatalog:
+    """
+    Весь CSV с мёртвыми остатками с уже разобранными TANK и FuelType. Разбор хранится
+    в Parquet и используется повторно, пока CSV не изменился: сначала сравниваются
+    mtime и размер, при расхождении — SHA-256 содержимого (файл могли перезаписать
+    теми же данными). from_cache показывает, откуда взят каталог при последнем load().
+    """
+
+    def __init__(self, csv_path, cache_dir):
+        self.csv_path = csv_path
+        self.cache_dir = cache_dir
+        self.catalog_path = os.path.join(cache_dir, CATALOG_NAME)
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+        self.from_cache = False
+
+    #######################################################################
+    # Кэш разбора
+    #######################################################################
+    def _load_manifest(self):
+        if not os.path.exists(self.catalog_path):
+            return {}
+        manifest = read_json(self.manifest_path, 'каталог будет разобран заново')
+        if manifest.get('format') != CATALOG_FORMAT or manifest.get('csv') != os.path.abspath(self.csv_path):
+            return {}
+        return manifest
+
+    def _save(self, catalog, manifest):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_parquet(self.catalog_path, catalog)
+        write_json(self.manifest_path, manifest)
+
+    #######################################################################
+    # Чтение
+    #######################################################################
+    def load(self):
+        """Каталог с колонками CSV (после переименования) и разобранными TANK, FuelType"""
+        stat = os.stat(self.csv_path)
+        manifest = self._load_manifest()
+        sha256 = None
+
+        if manifest:
+            unchanged = manifest.get('mtime_ns') == stat.st_mtime_ns and manifest.get('size') == stat.st_size
+            if not unchanged:
+                sha256 = file_sha256(self.csv_path)
+                unchanged = manifest.get('sha256') == sha256
+            if unchanged:
+                catalog = read_parquet(self.catalog_path, 'каталог будет разобран заново')
+                if catalog is not None:
+                    if sha256 is not None:
+                        # Содержимое то же — запоминаем новый mtime, чтобы не хешировать каждый запуск
+                        manifest.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                        try:
+                            write_json(self.manifest_path, manifest)
+                        except Exception as e:
+                            logging.warning(f"Не удалось обновить {self.manifest_path}: {e}")
+                    self.from_cache = True
+                    return catalog
+
+        catalog = read_catalog(self.csv_path)
+        self.from_cache = False
+        manifest = {
+            'format': CATALOG_FORMAT,
+            'csv': os.path.abspath(self.csv_path),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha256': sha256 or file_sha256(self.csv_path),
+            'rows': len(catalog),
+            'parsed_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        try:
+            self._save(catalog, manifest)
+        except Exception as e:
+            logging.warning(f"Не удалось сохранить кэш каталога мёртвых остатков: {e}")
+        return catalog
@@ -0,0 +1,49 @@
+# Параллельная стадия загрузки: независимые запросы к разным базам выполняются одновременно
+import time
+import logging
+import concurrent.futures
+
+
+class FetchStage:
+    """
+    Именованные задачи загрузки с зависимостями. Задача запускается в пуле потоков сразу
+    при добавлении и получает результаты своих зависимостей аргументами, поэтому
+    общее время стадии определяется самой долгой цепочкой запросов, а не их суммой.
+    Зависимости должны быть добавлены раньше зависящей задачи — тогда ожидание
+    внутри потока пула не может привести к взаимной блокировке.
+    """
+
+    def __init__(self, max_workers=4):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch')
+        self.futures = {}
+        self.timings = {}
+
+    def add(self, name, func, *deps):
+        """Запускает func(*результаты deps) под именем name"""
+        missing = [dep for dep in deps if dep not in self.futures]
+        if missing:
+            raise KeyError(f"Задача {name}: неизвестные зависимости {missing}")
+        dep_futures = [self.futures[dep] for dep in deps]
+
+        def run():
+            args = [future.result() for future in dep_futures]
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.timings[name] = time.perf_counter() - started
+
+        self.futures[name] = self.executor.submit(run)
+        return self.futures[name]
+
+    def result(self, name, timeout=None):
+        """Результат задачи; исключение задачи (или её зависимости) пробрасывается вызывающему"""
+        return self.futures[name].result(timeout=timeout)
+
+    def done(self, name):
+        return self.futures[name].done()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.timings:
+            logging.info("Стадия загрузки: " + ", ".join(f"{n} {s:.2f} с" for n, s in self.timings.items()))
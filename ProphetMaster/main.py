@@ -1,29 +1,154 @@
 # Импорт необходимых модулей
+# Тяжёлые зависимости (prophet, pyodbc, oracledb, SQLAlchemy) импортируются
+# только в той стадии, где они нужны
+import sys
+from startup_profile import StartupProfile
+
+# --profile-startup: время тяжёлых импортов и стадий запуска
+profiler = StartupProfile(enabled='--profile-startup' in sys.argv)
+
 import pandas as pd
 import logging
-from prophet import Prophet
-from sqlalchemy import create_engine, text
-import sys
-import pyodbc
-import oracledb
-import re
-from datetime import datetime, timedelta
+import os
+import argparse
+from datetime import date, datetime, timedelta
 import numpy as np
 from urllib.parse import quote_plus
 import concurrent.futures  # для многопоточного выполнения
 import time
-
-# Инициализация Oracle клиента (укажите свою папку с instantclient)
-oracledb.init_oracle_client(lib_dir=r"C:\instantclient_23_7")
+import random
+import threading
+import queue
+
+from sales_history import SalesHistoryStore, normalize_key, normalize_sales_frame, split_by_key
+from sales_ingest import ingest_sales
+from query_layer import QueryLayer
+from measurement_snapshot import MeasurementSnapshot, MeasurementHistory
+from series_matrix import SeriesMatrix
+from deadstock_catalog import DeadstockCatalog, read_catalog
+from tank_registry import TankRegistry
+from weekday_profile import series_profiles
+from oracle_pool import OraclePool
+from odbc_pool import PyodbcPool
+from connection_manager import ConnectionManager
+from fetch_stage import FetchStage
+from data_sources import DataSource, LocalDataSource, LOCAL_DATA_DIR, DEADSTOCK_CSV_NAME
+
+profiler.checkpoint('импорт pandas, numpy и модулей проекта')
+
+# Источник данных: 'production' — SQL Server + Oracle, 'local' — локальные копии
+# таблиц в SQLite (см. data_sources.py) для прогонов и замеров без доступа к боевым БД
+DATA_SOURCE = os.environ.get('PROPHET_DATA_SOURCE', 'production')
+DEADSTOCK_CSV = DEADSTOCK_CSV_NAME if DATA_SOURCE == 'production' else os.path.join(LOCAL_DATA_DIR, DEADSTOCK_CSV_NAME)
+
+# Папка Instant Client для толстого режима Oracle; если её нет — тонкий режим без клиента
+ORACLE_CLIENT_LIB_DIR = os.environ.get('ORACLE_CLIENT_LIB_DIR', r"C:\instantclient_23_7")
+ORACLE_STMT_CACHE_SIZE = 40
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Локальный кэш истории ord_salesbyhour (Parquet, по одной комбинации на файл)
+USE_SALES_HISTORY_CACHE = True
+SALES_HISTORY_DIR = 'sales_history'
+SALES_REREAD_DAYS = 3  # окно повторного чтения для поздних корректировок
+
+# Разобранный каталог мёртвых остатков (TANK, FuelType) в Parquet; перечитывается, только когда CSV изменился
+USE_DEADSTOCK_CACHE = True
+DEADSTOCK_CACHE_DIR = 'deadstock_catalog'
+
+# Снимок последних замеров BI.tigmeasurements: дочитываем только ID новее водяной метки
+USE_MEASUREMENT_SNAPSHOT = True
+MEASUREMENT_SNAPSHOT_DIR = 'measurement_snapshot'
+
+# Суммировать продажи по (день, час, АЗС, топливо, резервуар) на стороне SQL Server,
+# включая перенос часа 24 на 0 часов следующего дня
+AGGREGATE_SALES_IN_SQL = True
+
+# Потоковая загрузка ord_salesbyhour порциями: каждая комбинация уходит на прогноз,
+# как только её история прочитана целиком, и весь df_all в памяти не держится
+STREAM_SALES = True
+SALES_CHUNK_ROWS = 100000
+
+# Параллельная загрузка: комбинации шардируются по OBJECTCODE, партиции читаются
+# одновременно через пул подключений (не больше pool_size движка SQL Server)
+SALES_FETCH_PARTITIONS = 8
+SALES_FETCH_CONCURRENCY = 4
+
+# Пул запасного подключения PyODBC (SimpleEngine): размер как pool_size + max_overflow
+# основного движка, проверка SELECT 1 после простоя и пересоздание старых подключений
+ODBC_POOL_SIZE = 15
+ODBC_POOL_PING_AFTER = 30
+ODBC_POOL_RECYCLE = 3600
+
+# Повторы подключения к SQL Server: экспоненциальная задержка с джиттером
+# (SQL_RETRY_BASE_DELAY * 2^n, не больше SQL_RETRY_MAX_DELAY) и выключатель,
+# размыкающийся после SQL_CIRCUIT_FAILURES ошибок подряд на SQL_CIRCUIT_RESET секунд.
+# Порог выше числа одновременно читаемых партиций: один сбой сети, замеченный всеми
+# партициями сразу, не должен размыкать выключатель
+SQL_RETRY_BASE_DELAY = 1.0
+SQL_RETRY_MAX_DELAY = 30.0
+SQL_CIRCUIT_FAILURES = SALES_FETCH_CONCURRENCY + 2
+SQL_CIRCUIT_RESET = 60.0
+
+# Количество потоков для прогнозирования
+MAX_WORKERS = 4
+
+# Сколько загруженных комбинаций набирать перед заполнением пропусков в матрице продаж
+# одним проходом: больше — меньше проходов, меньше — раньше стартуют первые прогнозы
+SERIES_FILL_BATCH = MAX_WORKERS * 2
+
+# Потоки стадии загрузки: статусы АЗС, снимок замеров и объёмы резервуаров
+# читаются одновременно с выгрузкой продаж из SQL Server, там же импортируется prophet
+FETCH_STAGE_WORKERS = 4
+
+# Наборы OBJECTCODE для Oracle: до ORACLE_IN_LIST_MAX — список bind-переменных в IN,
+# больше — массивы (коллекция SYS.ODCIVARCHAR2LIST) порциями по ORACLE_ARRAY_CHUNK,
+# которые читаются параллельно через пул сессий
+ORACLE_IN_LIST_MAX = 500
+ORACLE_ARRAY_CHUNK = 2000
+
+# Глубина обучающей истории в днях (None — вся история). Ограничивает и запрос
+# к ord_salesbyhour, и historical_df в process_combination
+HISTORY_DAYS = 16 * 7
+# Переопределение глубины по виду топлива (название из fuel_mapping -> дней),
+# например {'СУГ': 26 * 7}
+HISTORY_DAYS_BY_FUEL = {}
+HISTORY_UNLIMITED_START = '1900-01-01'
+
+# Регионы по умолчанию (City и Branch из CSV); переопределяются --city и --branch
+DEFAULT_CITIES = ["Астана"]
+DEFAULT_BRANCHES = ["ВКО"]
+
+# Коды завершения для планировщика и цепочек задач
+EXIT_OK = 0          # прогноз посчитан и записан (или --dry-run)
+EXIT_FAILURE = 1     # ошибка чтения данных или записи в ord_forecast
+EXIT_USAGE = 2       # неверные аргументы (как у argparse)
+EXIT_NO_DATA = 3     # после фильтров не осталось комбинаций или прогнозов
+EXIT_CANCELLED = 4   # оператор отказался от запуска в интерактивном режиме
+
+# Состояние запуска: заполняется в main() и run_pipeline(), читается функциями разделов 5-10.
+# При бэкфилле FORECAST_DATE — первая дата диапазона (от неё считается начало истории)
+FORECAST_DATE = None
+FORECAST_HOURS = None
+sql_manager = None
+oracle_pool = None
+data_source = None
+fetch_stage = None
+city_data = None
+unique_objcodes = []
+params_list = []
+object_codes, gasnums, tanks = [], [], []
+tank_registry = None  # TankRegistry: мёртвый остаток и начальные объёмы по (OBJECTCODE, TANK, GASNUM)
+
 #######################################################################
 # 0. Функция создания подключения к SQL Server с правильным форматом
 #######################################################################
 def create_robust_sql_connection(max_retries=3):
     """Создание подключения к SQL Server с повторными попытками"""
+    import pyodbc
+    from sqlalchemy import create_engine, text
+
     driver = 'ODBC Driver 18 for SQL Server'
     host = ''
     port = ''
@@ -69,6 +194,7 @@ def create_robust_sql_connection(max_retries=3):
                 max_overflow=10,
                 pool_timeout=60,
                 pool_recycle=3600,
+                pool_pre_ping=True,  # дешёвая проверка подключения перед выдачей из пула
                 connect_args={
                     "timeout": 60,
                     "autocommit": True
@@ -98,8 +224,9 @@ def create_robust_sql_connection(max_retries=3):
                 pass
             
             if attempt < max_retries - 1:
-                print(f"⏳ Ожидание 10 секунд перед повтором...")
-                time.sleep(10)
+                delay = min(SQL_RETRY_MAX_DELAY, SQL_RETRY_BASE_DELAY * (2 ** attempt)) * random.uniform(0.5, 1.5)
+                print(f"⏳ Ожидание {delay:.1f} с перед повтором...")
+                time.sleep(delay)
             else:
                 print("💥 Все попытки подключения исчерпаны!")
                 
@@ -158,36 +285,41 @@ def create_alternative_connection():
     for i, conn_str in enumerate(connection_strings, 1):
         try:
             print(f"   Пробуем вариант {i}...")
-            conn = pyodbc.connect(conn_str)
-            
-            # Создаем простой engine через create_engine с raw подключением
-            def get_connection():
-                return pyodbc.connect(conn_str)
+            # Пул с теми же пределами, что и у основного движка (pool_size + max_overflow, pool_recycle):
+            # get_conn() берёт подключение из пула, а close() возвращает его обратно
+            pool = PyodbcPool(
+                conn_str,
+                max_size=ODBC_POOL_SIZE,
+                timeout=60,
+                ping_after=ODBC_POOL_PING_AFTER,
+                recycle_seconds=ODBC_POOL_RECYCLE
+            )
+            conn = pool.acquire()
             
             # Создаем "псевдо-engine" для совместимости
             class SimpleEngine:
-                def __init__(self, connection_func):
-                    self.get_conn = connection_func
+                def __init__(self, pool):
+                    self.pool = pool
+                    self.get_conn = pool.acquire
                     
                 def connect(self):
                     return self.get_conn()
                     
                 def execute(self, query):
-                    conn = self.get_conn()
-                    cursor = conn.cursor()
-                    cursor.execute(str(query))
-                    result = cursor.fetchall()
-                    cursor.close()
-                    conn.close()
+                    with self.get_conn() as conn:
+                        cursor = conn.cursor()
+                        cursor.execute(str(query))
+                        result = cursor.fetchall()
+                        cursor.close()
                     return result
                     
                 def dispose(self):
-                    pass
+                    self.pool.close()
                     
                 def begin(self):
                     return self.connect()
             
-            engine = SimpleEngine(get_connection)
+            engine = SimpleEngine(pool)
             
             print(f"✅ Альтернативное подключение (вариант {i}) успешно!")
             return conn, engine, conn_str
@@ -198,46 +330,293 @@ def create_alternative_connection():
     
     raise Exception("Все альтернативные способы подключения не сработали")
 
-def execute_query_with_retry(query, engine, connection_string, username, password, host, database, driver, max_retries=3):
-    """Выполнение запроса с повторными попытками"""
-    for attempt in range(max_retries):
-        try:
-            print(f"🔄 Выполнение запроса... (попытка {attempt + 1}/{max_retries})")
-            
-            # Если у нас простой engine, используем PyODBC напрямую
-            if hasattr(engine, 'get_conn'):
-                conn = engine.get_conn()
-                df = pd.read_sql_query(query, con=conn)
+def connect_sql_server():
+    """Фабрика движка SQL Server для ConnectionManager: основной способ, затем альтернативный"""
+    test_conn, engine, _ = create_robust_sql_connection(max_retries=1)
+    # Тестовое подключение больше не нужно — дальше работаем только через пул движка
+    test_conn.close()
+    return engine
+
+def open_raw_connection(sql_engine):
+    """DBAPI-подключение как для SQLAlchemy engine, так и для SimpleEngine (PyODBC)"""
+    if hasattr(sql_engine, 'get_conn'):
+        return sql_engine.get_conn()
+    return sql_engine.raw_connection()
+
+def execute_query_with_retry(query, max_retries=3, wait_for_circuit=False):
+    """
+    Выполнение запроса с повторными попытками.
+    query — текст SQL или функция query(engine) -> DataFrame (запросы с bind-переменными).
+    wait_for_circuit — ждать замыкания выключателя вместо ошибки (см. ConnectionManager.run)
+    """
+    def run_query(engine):
+        if callable(query):
+            return query(engine)
+        # Если у нас простой engine, используем PyODBC напрямую
+        if hasattr(engine, 'get_conn'):
+            conn = engine.get_conn()
+            try:
+                return pd.read_sql_query(query, con=conn)
+            finally:
                 conn.close()
-            else:
-                # Стандартный SQLAlchemy
-                df = pd.read_sql_query(query, con=engine)
-            
-            print(f"✅ Запрос выполнен успешно. Получено {len(df):,} строк")
-            return df
-            
-        except Exception as e:
-            print(f"❌ Попытка {attempt + 1} не удалась: {e}")
-            
-            if attempt < max_retries - 1:
-                print("⏳ Ожидание 15 секунд перед повтором...")
-                time.sleep(15)
-                
-                # Пересоздаем подключение при проблемах
-                print("🔄 Пересоздание подключения к SQL Server...")
-                try:
-                    if hasattr(engine, 'dispose'):
-                        engine.dispose()
-                    
-                    # Пересоздаем подключение
-                    new_conn, engine, _ = create_robust_sql_connection(max_retries=1)
-                    print("✅ Подключение пересоздано")
-                        
-                except Exception as reconnect_error:
-                    print(f"⚠️ Не удалось пересоздать подключение: {reconnect_error}")
-            else:
-                print("💥 Все попытки исчерпаны!")
-                raise
+        # Стандартный SQLAlchemy
+        return pd.read_sql_query(query, con=engine)
+
+    df = sql_manager.run(
+        run_query, max_retries=max_retries, description="выполнение запроса", wait_for_circuit=wait_for_circuit
+    )
+    print(f"✅ Запрос выполнен успешно. Получено {len(df):,} строк")
+    return df
+
+#######################################################################
+# Запросы с bind-переменными: текст SQL постоянный, значения только через параметры
+#######################################################################
+sql_queries = QueryLayer('SQL Server', paramstyle='qmark')
+oracle_queries = QueryLayer('Oracle', paramstyle='named')
+
+# Точные комбинации (objectcode, gasnum, tank) с началом обучающей истории.
+# Временная таблица живёт в сессии, поэтому создаётся заново на каждом подключении;
+# COLLATE DATABASE_DEFAULT исключает конфликт сортировок tempdb и рабочей базы
+sql_queries.register('keys_table_create', """
+IF OBJECT_ID('tempdb..#k') IS NOT NULL DROP TABLE #k;
+CREATE TABLE #k (
+    objectcode NVARCHAR(50) COLLATE DATABASE_DEFAULT,
+    gasnum NVARCHAR(50) COLLATE DATABASE_DEFAULT,
+    tank INT,
+    history_start DATE
+);
+""")
+sql_queries.register('keys_table_insert', "INSERT INTO #k (objectcode, gasnum, tank, history_start) VALUES (?, ?, ?, ?)")
+
+SALES_RAW_SQL = """
+SELECT
+    CAST(s.r_day AS DATE) AS DATE,
+    s.r_hour AS R_HOUR,
+    s.objectcode AS OBJECTCODE,
+    s.gasnum AS GASNUM,
+    s.tank AS TANK,
+    ISNULL(s.RECEIPTS_VOLUME, 0) AS RECEIPTS_VOLUME
+FROM ord_salesbyhour s
+JOIN #k k
+    ON s.objectcode = k.objectcode
+    AND s.gasnum = k.gasnum
+    AND s.tank = k.tank
+    AND s.r_day >= k.history_start
+WHERE s.r_day >= ?
+"""
+
+# Агрегация на сервере: одна строка на (DATE, R_HOUR, комбинация). Час 24 (и 0)
+# переносится на следующий день, поэтому нижняя граница r_day берётся на день раньше
+# (первый параметр), а since сравнивается с уже перенесённой датой (второй параметр)
+SALES_HOURLY_SQL = """
+SELECT
+    h.DATE,
+    h.R_HOUR,
+    h.OBJECTCODE,
+    h.GASNUM,
+    h.TANK,
+    SUM(h.RECEIPTS_VOLUME) AS RECEIPTS_VOLUME
+FROM (
+    SELECT
+        CASE WHEN s.r_hour IN (0, 24)
+             THEN DATEADD(DAY, 1, CAST(s.r_day AS DATE))
+             ELSE CAST(s.r_day AS DATE)
+        END AS DATE,
+        s.r_hour % 24 AS R_HOUR,
+        s.objectcode AS OBJECTCODE,
+        s.gasnum AS GASNUM,
+        s.tank AS TANK,
+        ISNULL(s.RECEIPTS_VOLUME, 0) AS RECEIPTS_VOLUME
+    FROM ord_salesbyhour s
+    JOIN #k k
+        ON s.objectcode = k.objectcode
+        AND s.gasnum = k.gasnum
+        AND s.tank = k.tank
+        AND s.r_day >= k.history_start
+    WHERE s.r_day >= ?
+) h
+WHERE h.DATE >= ?
+GROUP BY h.DATE, h.R_HOUR, h.OBJECTCODE, h.GASNUM, h.TANK
+"""
+
+sql_queries.register('sales_raw', SALES_RAW_SQL)
+sql_queries.register('sales_raw_ordered', SALES_RAW_SQL + "ORDER BY s.objectcode, s.gasnum, s.tank, s.r_day, s.r_hour")
+sql_queries.register('sales_hourly', SALES_HOURLY_SQL)
+sql_queries.register('sales_hourly_ordered', SALES_HOURLY_SQL + "ORDER BY h.OBJECTCODE, h.GASNUM, h.TANK, h.DATE, h.R_HOUR")
+
+sql_queries.register('delete_forecasts', """
+DELETE f
+FROM ord_forecast f
+JOIN #k k
+    ON f.objectcode = k.objectcode
+    AND f.gasnum = k.gasnum
+    AND f.tank = k.tank
+WHERE f.date_time BETWEEN ? AND ?
+""")
+
+def register_by_codes(name, sql):
+    """
+    Регистрирует запрос с фильтром по OBJECTCODE в двух вариантах: {codes} заменяется
+    списком bind-переменных (name) или массивом-коллекцией (name + '_array')
+    """
+    oracle_queries.register(name, sql.replace('{codes}', ':codes'))
+    oracle_queries.register(name + '_array', sql.replace('{codes}', 'SELECT COLUMN_VALUE FROM TABLE(:codes)'))
+
+register_by_codes('station_statuses', """
+SELECT t.OBJECTCODE, t.STATUS
+FROM GS.AZS t
+WHERE t.OBJECTCODE IN ({codes})
+""")
+
+# Диапазоны по POSTIMESTAMP без TRUNC, чтобы Oracle мог использовать индекс
+register_by_codes('current_volumes', """
+SELECT t.OBJECTCODE, t.TANK, t.GASNUM, t.VOLUME
+FROM BI.tigmeasurements t
+WHERE t.ID IN (
+    SELECT MAX(ID)
+    FROM BI.tigmeasurements
+    WHERE POSTIMESTAMP >= :day_start AND POSTIMESTAMP < :day_end
+      AND OBJECTCODE IN ({codes})
+    GROUP BY OBJECTCODE, TANK, GASNUM
+)
+""")
+
+register_by_codes('fallback_volumes', """
+SELECT OBJECTCODE, TANK, GASNUM, AVG(VOLUME) AS VOLUME
+FROM BI.tigmeasurements
+WHERE POSTIMESTAMP >= :start_ts AND POSTIMESTAMP < :end_ts
+  AND OBJECTCODE IN ({codes})
+GROUP BY OBJECTCODE, TANK, GASNUM
+""")
+
+register_by_codes('measurements', """
+SELECT ID, OBJECTCODE, TANK, GASNUM, VOLUME, POSTIMESTAMP
+FROM BI.tigmeasurements
+WHERE POSTIMESTAMP >= :start_ts AND POSTIMESTAMP < :end_ts
+  AND ID > :after_id
+  AND OBJECTCODE IN ({codes})
+""")
+
+def keys_table_rows(keys):
+    """
+    (OBJECTCODE, GASNUM, TANK) -> строки #k с началом обучающей истории комбинации.
+    r_day сравнивается с ним до переноса часа 24, поэтому граница на день раньше: час 24
+    предыдущих суток — это полночь первого дня истории (лишние часы отсекает матрица продаж)
+    """
+    rows = []
+    for object_code, gasnum, tank in sorted({normalize_key(k) for k in keys}):
+        history_start = history_start_for(gasnum)
+        if history_start is not None:
+            start = history_start.date() - timedelta(days=1)
+        else:
+            start = date.fromisoformat(HISTORY_UNLIMITED_START)
+        rows.append((object_code, gasnum, tank, start))
+    return rows
+
+def load_keys_table(sql_conn, keys):
+    """Заполняет временную таблицу #k комбинациями keys одним массивом параметров"""
+    sql_queries.execute(sql_conn, 'keys_table_create')
+    sql_queries.executemany(sql_conn, 'keys_table_insert', keys_table_rows(keys))
+
+def filter_keys(df, keys):
+    """Оставляет строки [OBJECTCODE, TANK, GASNUM, ...] только по точным комбинациям keys"""
+    df.columns = [col.upper() for col in df.columns]
+    wanted = pd.DataFrame(
+        [(o, t, g) for o, g, t in {normalize_key(k) for k in keys}], columns=['OBJECTCODE', 'TANK', 'GASNUM']
+    )
+    df = df.astype({'OBJECTCODE': str, 'GASNUM': str, 'TANK': 'int64'})
+    return df.merge(wanted, on=['OBJECTCODE', 'TANK', 'GASNUM'], how='inner')
+
+def oracle_timestamp(value):
+    return pd.Timestamp(value).to_pydatetime()
+
+def read_oracle_by_codes(name, object_codes, params=None):
+    """
+    Запрос name с фильтром по набору OBJECTCODE любого размера. Небольшой набор уходит
+    одним запросом со списком bind-переменных; большой (вся сеть АЗС) — порциями-массивами
+    параллельно, не больше порций одновременно, чем сессий в пуле. Все запросы группируют
+    по OBJECTCODE, поэтому результаты порций просто склеиваются.
+    """
+    codes = sorted({str(code) for code in object_codes})
+    if len(codes) <= ORACLE_IN_LIST_MAX:
+        with oracle_pool.acquire() as oracle_conn:
+            return oracle_queries.read(oracle_conn, name, params, lists={'codes': codes})
+
+    def read_chunk(chunk):
+        with oracle_pool.acquire() as oracle_conn:
+            codes_type = oracle_conn.gettype('SYS.ODCIVARCHAR2LIST')
+            chunk_params = dict(params or {})
+            chunk_params['codes'] = codes_type.newobject(chunk)
+            return oracle_queries.read(oracle_conn, name + '_array', chunk_params)
+
+    chunks = [codes[i:i + ORACLE_ARRAY_CHUNK] for i in range(0, len(codes), ORACLE_ARRAY_CHUNK)]
+    workers = max(1, min(len(chunks), oracle_pool.max_sessions))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        frames = list(executor.map(read_chunk, chunks))
+    return pd.concat(frames, ignore_index=True)
+
+class ProductionDataSource(DataSource):
+    """Боевые базы: SQL Server (ord_salesbyhour, ord_forecast) и Oracle (GS.AZS, BI.tigmeasurements)"""
+    name = 'production'
+
+    def read_station_statuses(self, object_codes):
+        # Запрос к Oracle для получения статусов АЗС
+        return read_oracle_by_codes('station_statuses', object_codes)
+
+    def iter_sales(self, keys, since=None):
+        return fetch_sales_partitioned(keys, since)
+
+    def read_current_volumes(self, keys, forecast_date):
+        day_start = pd.Timestamp(forecast_date).normalize()
+        current_df = read_oracle_by_codes('current_volumes', {k[0] for k in keys}, {
+            'day_start': oracle_timestamp(day_start),
+            'day_end': oracle_timestamp(day_start + pd.Timedelta(days=1)),
+        })
+        return filter_keys(current_df, keys)
+
+    def read_fallback_volumes(self, keys, forecast_date):
+        # Средние по всем резервуарам нужных АЗС, лишние комбинации отсекаются после
+        day_start = pd.Timestamp(forecast_date).normalize()
+        fallback_df = read_oracle_by_codes('fallback_volumes', {k[0] for k in keys}, {
+            'start_ts': oracle_timestamp(day_start - pd.Timedelta(days=30)),
+            'end_ts': oracle_timestamp(day_start + pd.Timedelta(days=1)),
+        })
+        return filter_keys(fallback_df, keys)
+
+    def read_measurements(self, object_codes, start, end, after_id=None):
+        return read_oracle_by_codes('measurements', object_codes, {
+            'start_ts': oracle_timestamp(start),
+            'end_ts': oracle_timestamp(end),
+            'after_id': int(after_id) if after_id is not None else 0,
+        })
+
+    def delete_forecasts(self, keys, start, end):
+        # Удаляем старые записи из ord_forecast только по точным комбинациям
+        sql_conn = open_raw_connection(sql_manager.engine)
+        try:
+            load_keys_table(sql_conn, keys)
+            row_count = sql_queries.execute(
+                sql_conn, 'delete_forecasts', (pd.Timestamp(start).to_pydatetime(), pd.Timestamp(end).to_pydatetime())
+            )
+            sql_conn.commit()
+            return row_count
+        finally:
+            sql_conn.close()
+
+    def insert_forecasts(self, df):
+        engine = sql_manager.engine
+        # Если у нас простой engine, используем PyODBC
+        if hasattr(engine, 'get_conn'):
+            conn_temp = engine.get_conn()
+            df.to_sql('ord_forecast', con=conn_temp, if_exists='append', index=False)
+            conn_temp.close()
+        else:
+            # Стандартный SQLAlchemy
+            df.to_sql('ord_forecast', con=engine, if_exists='append', index=False)
+
+    def close(self):
+        oracle_pool.close()
+        sql_manager.close()
 
 #######################################################################
 # 1. ФУНКЦИЯ ВЫБОРА ДАТЫ ПРОГНОЗА
@@ -320,213 +699,190 @@ def select_forecast_date():
     
     return selected_date
 
+def parse_forecast_date(value):
+    """Дата прогноза из командной строки: YYYY-MM-DD или today"""
+    if value.strip().lower() == 'today':
+        return datetime.now()
+    try:
+        selected_date = datetime.strptime(value.strip(), "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"неверный формат даты {value!r}, используйте YYYY-MM-DD или today")
+    if selected_date > datetime.now():
+        raise argparse.ArgumentTypeError(f"нельзя выбрать будущую дату {value}")
+    return selected_date
+
+def parse_args(argv=None):
+    """
+    Аргументы запуска. С --date скрипт работает без вопросов (планировщик, цепочки задач),
+    без --date дата выбирается в меню и запрашивается подтверждение, как раньше.
+    Ошибки в аргументах завершают скрипт с кодом EXIT_USAGE.
+    """
+    parser = argparse.ArgumentParser(
+        description="Прогноз продаж топлива и достижения мёртвого остатка с записью в ord_forecast",
+        epilog=(
+            f"Коды завершения: {EXIT_OK} — прогноз записан, {EXIT_FAILURE} — ошибка загрузки или записи, "
+            f"{EXIT_USAGE} — неверные аргументы, {EXIT_NO_DATA} — нет данных для прогноза, "
+            f"{EXIT_CANCELLED} — отменено оператором"
+        )
+    )
+    parser.add_argument('--date', type=parse_forecast_date,
+                        help="дата прогноза YYYY-MM-DD или today (без неё — интерактивный выбор)")
+    parser.add_argument('--until', type=parse_forecast_date,
+                        help="бэкфилл: прогнозы на каждый день от --date до --until с одной загрузкой истории")
+    parser.add_argument('--hours', type=int,
+                        help="горизонт прогноза в часах (по умолчанию 71 в пятницу, иначе 47)")
+    parser.add_argument('--city', action='append',
+                        help=f"город из CSV, можно повторять (по умолчанию {', '.join(DEFAULT_CITIES)})")
+    parser.add_argument('--branch', action='append',
+                        help=f"ветка из CSV, можно повторять (по умолчанию {', '.join(DEFAULT_BRANCHES)})")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="посчитать прогнозы, не удаляя и не записывая ord_forecast")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="напечатать время стадий запуска и тяжёлых импортов")
+    args = parser.parse_args(argv)
+
+    if args.hours is not None and args.hours < 1:
+        parser.error("--hours должен быть положительным числом")
+    if args.until is not None:
+        if args.date is None:
+            parser.error("--until задаётся вместе с --date (первая дата бэкфилла)")
+        if args.until.date() < args.date.date():
+            parser.error("--until не может быть раньше --date")
+    # Фильтры регионов: если не задан ни город, ни ветка — берём регионы по умолчанию
+    if args.city is None and args.branch is None:
+        args.city, args.branch = list(DEFAULT_CITIES), list(DEFAULT_BRANCHES)
+    return args
+
 #######################################################################
-# 2. Подключение к SQL Server с улучшенной обработкой ошибок
+# 2. Подключение к SQL Server и Oracle
 #######################################################################
-print("🔧 Инициализация подключения к SQL Server...")
-try:
-    conn, engine, connection_string = create_robust_sql_connection()
-    
-    # Сохраняем параметры для retry функций
-    driver = 'ODBC Driver 18 for SQL Server'
-    host = '10.10.120.6'
-    port = '1433'
-    database = 'eho_export2acc'
-    username = 'powerbi'
-    password = 'De$!gn2025_@'
-    driver_encoded = driver
-    
-except Exception as e:
-    logging.error(f"Критическая ошибка при подключении к SQL Server: {e}")
-    print(f"💥 Критическая ошибка при подключении к SQL Server: {e}")
-    sys.exit(1)
+def open_data_source():
+    """Источник данных; подключения к SQL Server и Oracle создаются при первом запросе"""
+    global sql_manager, oracle_pool
+
+    if DATA_SOURCE != 'production':
+        print(f"🧪 Локальный источник данных: {LOCAL_DATA_DIR} (без подключения к SQL Server и Oracle)")
+        return LocalDataSource(
+            LOCAL_DATA_DIR,
+            aggregate=AGGREGATE_SALES_IN_SQL,
+            history_start_for=lambda gasnum: history_start_for(gasnum)
+        )
+
+    sql_manager = ConnectionManager(
+        'SQL Server',
+        connect_sql_server,
+        base_delay=SQL_RETRY_BASE_DELAY,
+        max_delay=SQL_RETRY_MAX_DELAY,
+        failure_threshold=SQL_CIRCUIT_FAILURES,
+        reset_timeout=SQL_CIRCUIT_RESET
+    )
+
+    oracle_username = "alikhan"
+    oracle_password = "C0n$ul25"
+    oracle_host = "10.10.120.96"
+    oracle_port = "1521"
+    oracle_service_name = "ORCL"
+
+    # Пул создаётся при первом запросе; сессий не больше, чем потоков прогноза
+    oracle_pool = OraclePool(
+        oracle_username, oracle_password, oracle_host, oracle_port, oracle_service_name,
+        min_sessions=1,
+        max_sessions=MAX_WORKERS,
+        stmt_cache_size=ORACLE_STMT_CACHE_SIZE,
+        lib_dir=ORACLE_CLIENT_LIB_DIR
+    )
+    return ProductionDataSource()
 
 #######################################################################
 # 3. Определение даты прогноза и настройка
 #######################################################################
-# Выбираем дату прогноза
-forecast_datetime = select_forecast_date()
-FORECAST_DATE = forecast_datetime.strftime("%Y-%m-%d")
-
-# Определяем, является ли выбранная дата пятницей (пятница имеет weekday=4 в Python)
-IS_FRIDAY = forecast_datetime.weekday() == 4
-
-# Определяем горизонт прогноза в зависимости от дня недели
-if IS_FRIDAY:
-    FORECAST_HOURS = 71  # 3 дня (72 часа минус 1)
-    forecast_period = "3 дня (71 час)"
-else:
-    FORECAST_HOURS = 47  # 2 дня (48 часов минус 1)
-    forecast_period = "2 дня (47 часов)"
-
-# Показываем итоговую информацию
-print("\n" + "="*50)
-print("ПАРАМЕТРЫ ПРОГНОЗА")
-print("="*50)
-print(f"Дата прогноза: {FORECAST_DATE}")
-print(f"День недели: {['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье'][forecast_datetime.weekday()]}")
-print(f"Горизонт прогноза: {forecast_period}")
-print(f"Период прогноза: {forecast_datetime.strftime('%Y-%m-%d %H:%M')} - {(forecast_datetime + timedelta(hours=FORECAST_HOURS)).strftime('%Y-%m-%d %H:%M')}")
-print("="*50)
-
-# Подтверждение
-confirm = input("\nПродолжить с этими параметрами? (y/n): ").strip().lower()
-if confirm != 'y':
-    print("Операция отменена.")
-    sys.exit(0)
+def forecast_horizon(forecast_datetime, hours=None):
+    """FORECAST_HOURS и его описание для даты прогноза; hours переопределяет горизонт"""
+    if hours is not None:
+        return hours, f"{hours} ч (задано --hours)"
+    # Пятница (weekday=4) — прогноз на выходные
+    if forecast_datetime.weekday() == 4:
+        return 71, "3 дня (71 час)"  # 72 часа минус 1
+    return 47, "2 дня (47 часов)"  # 48 часов минус 1
+
+def print_forecast_parameters(forecast_datetime, forecast_period):
+    print("\n" + "="*50)
+    print("ПАРАМЕТРЫ ПРОГНОЗА")
+    print("="*50)
+    print(f"Дата прогноза: {FORECAST_DATE}")
+    print(f"День недели: {['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье'][forecast_datetime.weekday()]}")
+    print(f"Горизонт прогноза: {forecast_period}")
+    print(f"Период прогноза: {forecast_datetime.strftime('%Y-%m-%d %H:%M')} - {(forecast_datetime + timedelta(hours=FORECAST_HOURS)).strftime('%Y-%m-%d %H:%M')}")
+    print("="*50)
 
 #######################################################################
 # 4. Чтение CSV с мёртвыми остатками
 #######################################################################
-print("📄 Чтение данных из CSV...")
-try:
-    deadstock_data = pd.read_csv('deadstock_info_new.csv')
-
-    # Переименование столбцов в соответствии с вашими нуждами
-    deadstock_data.rename(columns={
-        'Gas_Station_Name': 'Gas_Station_Name',
-        'City': 'City',
-        'Branch': 'Branch',
-        'ObjectCode': 'OBJECTCODE',
-        'Tank_Number': 'Tank_Number',
-        'Deadstock_Level': 'Level_cm',
-        'Deadstock_Volume': 'Volume_liters',
-        'Max_Level': 'Max_Level',
-        'Max_Volume': 'Max_Volume'
-    }, inplace=True)
-
-    # Обрабатываем обе локации: Астана и ВКО
-    # Создаем пустой DataFrame для сбора данных из обеих локаций
-    filtered_data = pd.DataFrame()
-
-    # Фильтрация по городу
-    city_data = deadstock_data[deadstock_data['City'] == "Астана"].copy()
-    if not city_data.empty:
-        filtered_data = pd.concat([filtered_data, city_data])
-        print(f"✅ Данные для города Астана загружены. Кол-во строк: {len(city_data)}")
-
-    # Фильтрация по ветке ВКО
-    branch_data = deadstock_data[deadstock_data['Branch'] == "ВКО"].copy()
-    if not branch_data.empty:
-        filtered_data = pd.concat([filtered_data, branch_data])
-        print(f"✅ Данные для ветки ВКО загружены. Кол-во строк: {len(branch_data)}")
-
-    # Проверка, есть ли данные для обработки
-    if filtered_data.empty:
-        print("❌ Нет данных для города Астана или ветки ВКО в CSV. Останавливаем скрипт.")
-        sys.exit(1)
-
-    # Переименуем для совместимости с остальным кодом
-    city_data = filtered_data
-    
-except Exception as e:
-    logging.error(f"Ошибка при чтении CSV файла: {e}")
-    print(f"❌ Ошибка при чтении CSV файла: {e}")
-    sys.exit(1)
+def read_deadstock_catalog(cities, branches):
+    """Строки CSV с мёртвыми остатками для выбранных городов и веток"""
+    print("📄 Чтение данных из CSV...")
+    # Весь CSV с уже разобранными TANK и FuelType; без кэша разбор выполняется каждый запуск
+    if USE_DEADSTOCK_CACHE:
+        catalog = DeadstockCatalog(DEADSTOCK_CSV, os.path.join(DEADSTOCK_CACHE_DIR, data_source.name))
+        deadstock_data = catalog.load()
+        if catalog.from_cache:
+            print("📦 CSV не изменился — разобранный каталог взят из кэша")
+    else:
+        deadstock_data = read_catalog(DEADSTOCK_CSV)
+
+    # Собираем строки всех выбранных городов и веток (по умолчанию Астана и ВКО)
+    parts = []
+    for city in cities or []:
+        city_rows = deadstock_data[deadstock_data['City'] == city]
+        if not city_rows.empty:
+            parts.append(city_rows)
+            print(f"✅ Данные для города {city} загружены. Кол-во строк: {len(city_rows)}")
+
+    for branch in branches or []:
+        branch_rows = deadstock_data[deadstock_data['Branch'] == branch]
+        if not branch_rows.empty:
+            parts.append(branch_rows)
+            print(f"✅ Данные для ветки {branch} загружены. Кол-во строк: {len(branch_rows)}")
+
+    if not parts:
+        return deadstock_data.iloc[0:0].copy()
+    return pd.concat(parts)
 
 #######################################################################
-# 5. Подключение к Oracle и чтение статусов АЗС
+# 5. Чтение статусов АЗС и снимка замеров из Oracle
 #######################################################################
-print("🔧 Подключение к Oracle...")
-oracle_username = "alikhan"
-oracle_password = "C0n$ul25"
-oracle_host = "10.10.120.96"
-oracle_port = "1521"
-oracle_service_name = "ORCL"
-
-oracle_password_encoded = quote_plus(oracle_password)
-oracle_connection_string = (
-    f"oracle+oracledb://{oracle_username}:{oracle_password_encoded}"
-    f"@{oracle_host}:{oracle_port}/?service_name={oracle_service_name}"
-)
-
-try:
-    oracle_engine = create_engine(oracle_connection_string)
-    print("✅ Успешное подключение к Oracle.")
-except Exception as e:
-    logging.error(f"Ошибка при создании SQLAlchemy движка для Oracle: {e}")
-    print(f"❌ Ошибка при создании SQLAlchemy движка для Oracle: {e}")
-    sys.exit(1)
-
-# Собираем список уникальных OBJECTCODE из CSV
-unique_objcodes = city_data['OBJECTCODE'].unique().tolist()
-
-# Функция для формирования части IN(...)
-def prepare_in_clause(values, is_string=False):
-    if is_string:
-        return ','.join(f"'{v}'" for v in values)
-    else:
-        return ','.join(str(v) for v in values)
-
-objcodes_str = prepare_in_clause(unique_objcodes, is_string=True)
-
-# Запрос к Oracle для получения статусов АЗС
-status_query = f"""
-SELECT
-    t.OBJECTCODE,
-    t.STATUS
-FROM GS.AZS t
-WHERE t.OBJECTCODE IN ({objcodes_str})
-"""
-
-try:
-    status_df = pd.read_sql(status_query, con=oracle_engine)
-    status_df.columns = [col.upper().strip() for col in status_df.columns]
-    print("✅ Список статусов АЗС загружен из Oracle.")
-except Exception as e:
-    logging.error(f"Ошибка при чтении статусов из Oracle: {e}")
-    print(f"❌ Ошибка при чтении статусов из Oracle: {e}")
-    sys.exit(1)
-
-if status_df.empty:
-    print("❌ Не найдено никаких АЗС в Oracle по тем OBJECTCODE, что есть в CSV.")
-    sys.exit(1)
+def refresh_measurement_snapshot():
+    """Снимок последних замеров по всем АЗС из CSV — не ждёт фильтра по статусу"""
+    snapshot = MeasurementSnapshot(os.path.join(MEASUREMENT_SNAPSHOT_DIR, data_source.name))
+    new_measurements = snapshot.refresh(unique_objcodes, FORECAST_DATE, data_source.read_measurements)
+    print(f"📦 Снимок замеров: дочитано {new_measurements} новых строк, водяная метка ID {snapshot.manifest.get('watermark_id')}")
+    return snapshot
 
 #######################################################################
 # 6. Мерджим CSV-данные и статусы, оставляем только STATUS=1
 #######################################################################
-print("🔄 Обработка и фильтрация данных...")
-city_data = city_data.merge(status_df, on='OBJECTCODE', how='left')
-
-# Фильтруем только те, у которых статус = 1 (in progress)
-city_data = city_data[city_data['STATUS'] == 1]
-
-if city_data.empty:
-    print("❌ После фильтрации по STATUS=1 не осталось данных. Останавливаем скрипт.")
-    sys.exit(1)
+def filter_active_stations(city_data, status_df):
+    """Резервуары АЗС со статусом 1 (in progress)"""
+    print("🔄 Обработка и фильтрация данных...")
+    city_data = city_data.merge(status_df, on='OBJECTCODE', how='left')
+    return city_data[city_data['STATUS'] == 1]
 
 #######################################################################
 # 7. Предварительная обработка (извлечение TANK, FuelType)
 #######################################################################
-def extract_tank_and_fuel(tank_value):
-    # Ищем "Резервуар + число"
-    tank_match = re.search(r'Резервуар[ау]?\s*(\d+)', str(tank_value), re.IGNORECASE)
-    if (tank_match):
-        tank_number = int(tank_match.group(1))
-    else:
-        tank_number = None
-
-    # Ищем тип топлива с более точным сопоставлением
-    fuel_match = re.search(
-        r'(АИ-80|АИ-92|АИ-95|АИ-98|ДТ-З-32|ДТ-З-25|ДТ-Л|ДТЗ|ДТ|СУГ|АИ-95-IMPORT)',
-        str(tank_value),
-        re.IGNORECASE
-    )
-    if fuel_match:
-        fuel_name = fuel_match.group(1).upper()
-    else:
-        fuel_name = None
-
-    return pd.Series({'TANK': tank_number, 'FuelType': fuel_name})
-
-# Применяем функцию к полю 'Tank_Number'
-city_data[['TANK', 'FuelType']] = city_data['Tank_Number'].apply(extract_tank_and_fuel)
+def prepare_tanks(city_data):
+    """
+    Строки с разобранными TANK и FuelType (их разбирает из Tank_Number
+    deadstock_catalog.parse_tanks при чтении CSV); строки без них отбрасываются
+    """
+    city_data = city_data.copy()
 
-# Удаляем строки с отсутствующими данными
-city_data.dropna(subset=['TANK', 'FuelType'], inplace=True)
+    # Удаляем строки с отсутствующими данными
+    city_data.dropna(subset=['TANK', 'FuelType'], inplace=True)
 
-# Приводим TANK к int
-city_data['TANK'] = city_data['TANK'].astype(int)
+    # Приводим TANK к int
+    city_data['TANK'] = city_data['TANK'].astype(int)
+    return city_data
 
 # Словарь соответствия FuelType -> GASNUM
 fuel_mapping = {
@@ -543,248 +899,352 @@ fuel_mapping = {
     'ДТЗ': '3300000010'
 }
 
-print(f"✅ Количество строк после подготовки и фильтрации: {len(city_data)}")
-
-# Получаем уникальные комбинации
-unique_combinations = city_data[['OBJECTCODE', 'TANK', 'FuelType']].drop_duplicates()
-print(f"✅ Количество уникальных комбинаций: {len(unique_combinations)}")
+def history_start_for(gasnum, forecast_date=None):
+    """Начало обучающей истории для GASNUM с учётом переопределения по виду топлива"""
+    days = HISTORY_DAYS
+    for fuel_name, fuel_days in HISTORY_DAYS_BY_FUEL.items():
+        if fuel_mapping.get(fuel_name) == str(gasnum):
+            days = fuel_days
+            break
+    if days is None:
+        return None
+    return pd.Timestamp(forecast_date or FORECAST_DATE) - pd.Timedelta(days=days)
 
 #######################################################################
 # 8. Подготовка к чтению данных из ord_salesbyhour (SQL Server)
 #######################################################################
-# Собираем параметры (OBJECTCODE, GASNUM, TANK) для запроса
-params_list = []
-for _, row in unique_combinations.iterrows():
-    object_code = row['OBJECTCODE']
-    tank_number = row['TANK']
-    fuel_name   = row['FuelType']
-    gasnum      = fuel_mapping.get(fuel_name)
-    if gasnum:
-        params_list.append((object_code, gasnum, tank_number))
-
-object_codes = list({p[0] for p in params_list})
-gasnums      = list({p[1] for p in params_list})
-tanks        = list({p[2] for p in params_list})
-
-object_codes_str = prepare_in_clause(object_codes, is_string=True)
-gasnums_str      = prepare_in_clause(gasnums,      is_string=True)
-tanks_str        = prepare_in_clause(tanks,        is_string=False)
-
-# Запрос к ord_salesbyhour
-query_sales = f"""
-SELECT
-    CAST(r_day AS DATE) AS DATE,
-    r_hour AS R_HOUR,
-    objectcode AS OBJECTCODE,
-    gasnum AS GASNUM,
-    tank AS TANK,
-    ISNULL(RECEIPTS_VOLUME, 0) AS RECEIPTS_VOLUME
-FROM ord_salesbyhour
-WHERE
-    objectcode IN ({object_codes_str})
-    AND gasnum IN ({gasnums_str})
-    AND tank IN ({tanks_str})
-"""
+def build_params_list(unique_combinations):
+    """Параметры (OBJECTCODE, GASNUM, TANK) для запросов по уникальным комбинациям"""
+    params_list = []
+    for _, row in unique_combinations.iterrows():
+        object_code = row['OBJECTCODE']
+        tank_number = row['TANK']
+        fuel_name   = row['FuelType']
+        gasnum      = fuel_mapping.get(fuel_name)
+        if gasnum:
+            params_list.append((object_code, gasnum, tank_number))
+    return params_list
+
+def sales_statement(since=None, ordered=False):
+    """
+    Имя запроса к ord_salesbyhour и его параметры; since ограничивает r_day снизу.
+    Фильтрация идёт соединением с точными тройками (objectcode, gasnum, tank) из #k,
+    а не декартовым произведением трёх IN-списков.
+    ordered=True упорядочивает строки по комбинации — нужно для потоковой загрузки.
+    """
+    since = pd.Timestamp(since or HISTORY_UNLIMITED_START).to_pydatetime().date()
+    suffix = '_ordered' if ordered else ''
+    if AGGREGATE_SALES_IN_SQL:
+        return 'sales_hourly' + suffix, (since - timedelta(days=1), since)
+    return 'sales_raw' + suffix, (since,)
+
+def read_sales(sql_engine, keys, since=None):
+    """Все строки ord_salesbyhour для комбинаций keys одним DataFrame"""
+    name, params = sales_statement(since)
+    sql_conn = open_raw_connection(sql_engine)
+    try:
+        load_keys_table(sql_conn, keys)
+        return sql_queries.read(sql_conn, name, params)
+    finally:
+        sql_conn.close()
+
+def iter_sales_chunks(sql_engine, keys, since, chunksize):
+    """Строки ord_salesbyhour, упорядоченные по комбинации, порциями по chunksize строк"""
+    name, params = sales_statement(since, ordered=True)
+    sql_conn = open_raw_connection(sql_engine)
+    try:
+        load_keys_table(sql_conn, keys)
+        yield from sql_queries.iter_read(sql_conn, name, params, batch_size=chunksize)
+    finally:
+        sql_conn.close()
+
+def fetch_sales(keys, since=None):
+    """Загрузка строк ord_salesbyhour для комбинаций keys (начиная с since)"""
+    return execute_query_with_retry(
+        lambda sql_engine: read_sales(sql_engine, keys, since), max_retries=5, wait_for_circuit=True
+    )
 
-print(f"📊 Загрузка данных продаж для {len(object_codes)} АЗС, {len(gasnums)} видов топлива, {len(tanks)} резервуаров...")
-
-try:
-    df_all = execute_query_with_retry(
-        query_sales, 
-        engine, 
-        connection_string, 
-        username, 
-        password, 
-        host, 
-        database, 
-        driver, 
-        max_retries=5
+def stream_sales(keys, since=None, max_retries=5):
+    """
+    Потоковая загрузка ord_salesbyhour: отдаёт (ключ, строки) по каждой комбинации,
+    как только она прочитана целиком. Строки приходят упорядоченными по комбинации,
+    поэтому при сбое повторно запрашиваются только ещё не отданные комбинации.
+    Повторы и выключатель — ConnectionManager.run_iter: разомкнутый выключатель (его могли
+    разомкнуть соседние партиции) не тратит попытку, загрузка ждёт и продолжается.
+    """
+    categories = {
+        'OBJECTCODE': sorted({str(k[0]) for k in keys}),
+        'GASNUM': sorted({str(k[1]) for k in keys}),
+    }
+    remaining = sorted(set(keys))
+    done = set()
+
+    def read_remaining(engine):
+        nonlocal remaining
+        remaining = [k for k in remaining if normalize_key(k) not in done]
+        current_key, parts, rows = None, [], 0
+        print(f"📥 Потоковая загрузка {len(remaining)} комбинаций...")
+        for chunk in iter_sales_chunks(engine, remaining, since, SALES_CHUNK_ROWS):
+            rows += len(chunk)
+            chunk = normalize_sales_frame(chunk, categories)
+            for key, part in split_by_key(chunk):
+                if current_key is not None and key != current_key:
+                    yield current_key, pd.concat(parts, ignore_index=True)
+                    done.add(current_key)
+                    parts = []
+                current_key = key
+                parts.append(part)
+
+        if current_key is not None:
+            yield current_key, pd.concat(parts, ignore_index=True)
+            done.add(current_key)
+        print(f"✅ Потоковая загрузка завершена. Получено {rows:,} строк")
+
+    yield from sql_manager.run_iter(
+        read_remaining,
+        max_retries=max_retries,
+        description="потоковая загрузка ord_salesbyhour",
+        wait_for_circuit=True,
+        finished=lambda: all(normalize_key(k) in done for k in remaining)
     )
-    print(f"✅ Данные по продажам из ord_salesbyhour успешно загружены: {len(df_all):,} записей")
-except Exception as e:
-    logging.error(f"Критическая ошибка при чтении из ord_salesbyhour: {e}")
-    print(f"💥 Критическая ошибка при чтении из ord_salesbyhour: {e}")
-    sys.exit(1)
-
-# Преобразование DATE + R_HOUR -> datetime
-df_all['DATE'] = pd.to_datetime(df_all['DATE'], errors='coerce')
-df_all.loc[df_all['R_HOUR'] == 24, 'R_HOUR'] = 0
-df_all.loc[df_all['R_HOUR'] == 0, 'DATE'] = df_all['DATE'] + pd.Timedelta(days=1)
-
-df_all['ds'] = pd.to_datetime(
-    df_all['DATE'].dt.strftime('%Y-%m-%d') + ' ' +
-    df_all['R_HOUR'].astype(str) + ':00:00'
-)
-df_all['weekday'] = df_all['ds'].dt.weekday
-df_all['GASNUM']  = df_all['GASNUM'].astype(str)
 
-# Группируем
-grouped = df_all.groupby(['OBJECTCODE', 'TANK', 'GASNUM'])
+def fetch_sales_iter(keys, since=None):
+    """Загрузка одним запросом с последующей разбивкой по комбинациям"""
+    return split_by_key(normalize_sales_frame(fetch_sales(keys, since)))
+
+def partition_keys(keys, partitions):
+    """Шардирование комбинаций по OBJECTCODE: все резервуары одной АЗС попадают в одну партицию"""
+    object_codes_sorted = sorted({str(k[0]) for k in keys})
+    shard_of = {code: i % partitions for i, code in enumerate(object_codes_sorted)}
+    shards = [[] for _ in range(partitions)]
+    for key in keys:
+        shards[shard_of[str(key[0])]].append(key)
+    return [shard for shard in shards if shard]
+
+def fetch_sales_partitioned(keys, since=None):
+    """
+    Параллельная загрузка ord_salesbyhour по партициям. Каждая партиция читается
+    в своём потоке со своими повторными попытками, поэтому сбой одной партиции
+    не заставляет перечитывать остальные. Комбинации отдаются по мере готовности.
+    """
+    partition_fetch = stream_sales if STREAM_SALES else fetch_sales_iter
+    shards = partition_keys(keys, SALES_FETCH_PARTITIONS)
+    if len(shards) <= 1 or SALES_FETCH_CONCURRENCY <= 1:
+        yield from partition_fetch(keys, since)
+        return
+
+    print(f"🔀 Параллельная загрузка: {len(shards)} партиций, до {SALES_FETCH_CONCURRENCY} одновременно")
+    results = queue.Queue(maxsize=SALES_FETCH_CONCURRENCY * 2)
+    stop = threading.Event()
+
+    def put(item):
+        # Не блокируемся навсегда, если потребитель уже остановился
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch_partition(shard):
+        try:
+            if stop.is_set():
+                return
+            for item in partition_fetch(shard, since):
+                if not put(('series', item)):
+                    return
+        except Exception as e:
+            put(('error', e))
+        finally:
+            put(('done', None))
 
-print(f"📈 Данные обработаны. Период: {df_all['ds'].min()} - {df_all['ds'].max()}")
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=SALES_FETCH_CONCURRENCY)
+    try:
+        for shard in shards:
+            executor.submit(fetch_partition, shard)
+
+        pending = len(shards)
+        while pending:
+            kind, payload = results.get()
+            if kind == 'done':
+                pending -= 1
+            elif kind == 'error':
+                raise payload
+            else:
+                yield payload
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+
+def prepare_sales_series(df):
+    """
+    Преобразование DATE + R_HOUR -> ds и weekday для истории одной комбинации.
+    OBJECTCODE/GASNUM остаются категориями, час — int8, объём — float32.
+    """
+    # При агрегации в SQL перенос часа 24 уже выполнен на сервере
+    return ingest_sales(
+        df, 'DATE', 'R_HOUR', 'RECEIPTS_VOLUME',
+        key_columns=['OBJECTCODE', 'GASNUM'],
+        rollover=not AGGREGATE_SALES_IN_SQL
+    )
+
+def build_sales_matrix(forecast_dates):
+    """
+    Пустая матрица продаж ряд × час для всех комбинаций params_list: сетка от самого
+    раннего начала обучения среди дат прогноза до полуночи последней даты.
+    """
+    history_starts = [history_start_for(gasnum, forecast_dates[0]) for _, gasnum, _ in params_list]
+    # Неограниченная история (HISTORY_DAYS=None) — сетка начнётся с первого дня данных
+    start = None if any(s is None for s in history_starts) else min(history_starts, default=None)
+    return SeriesMatrix(len(params_list), start, forecast_dates[-1])
+
+def history_window(sales_matrix, group_key, forecast_date):
+    """(первый час, объёмы) комбинации для одной даты прогноза — срез строки матрицы"""
+    history_start = history_start_for(group_key[2], forecast_date)
+    return sales_matrix.window(group_key, history_start, pd.Timestamp(forecast_date))
+
+def load_sales_series():
+    """
+    Отдаёт ((OBJECTCODE, TANK, GASNUM), история продаж) по каждой комбинации из params_list.
+    Источник — локальный кэш с догрузкой из SQL Server, потоковая или разовая загрузка.
+    """
+    print(f"📊 Загрузка данных продаж для {len(object_codes)} АЗС, {len(gasnums)} видов топлива, {len(tanks)} резервуаров...")
+    fetch_iter = data_source.iter_sales
+
+    if USE_SALES_HISTORY_CACHE:
+        # Дочитываем только строки новее водяной метки локального кэша
+        # Источники, сырые и агрегированные строки храним раздельно, чтобы не смешивать данные
+        history_dir = os.path.join(
+            SALES_HISTORY_DIR, data_source.name, 'hourly' if AGGREGATE_SALES_IN_SQL else 'raw'
+        )
+        history_store = SalesHistoryStore(history_dir, reread_days=SALES_REREAD_DAYS)
+        # Нижняя граница кэша сверяется с тем же началом истории, что уходит в #k
+        series_iter = history_store.sync_iter(
+            params_list, fetch_iter, history_start=lambda key: history_start_for(key[1])
+        )
+    else:
+        series_iter = fetch_iter(params_list)
+
+    for (object_code, gasnum, tank_number), df in series_iter:
+        yield (object_code, tank_number, gasnum), prepare_sales_series(df)
 
 #######################################################################
 # 9. Загрузка текущих объёмов из Oracle (BI.tigmeasurements)
 #######################################################################
-print("📊 Загрузка текущих объемов из Oracle...")
-oracle_query_current = f"""
-SELECT t.OBJECTCODE, t.TANK, t.GASNUM, t.VOLUME
-FROM BI.tigmeasurements t
-WHERE t.ID IN (
-    SELECT MAX(ID)
-    FROM BI.tigmeasurements
-    WHERE TRUNC(POSTIMESTAMP) = TO_DATE('{FORECAST_DATE}', 'YYYY-MM-DD')
-    GROUP BY OBJECTCODE, TANK, GASNUM
-)
-AND t.OBJECTCODE IN ({object_codes_str})
-AND t.TANK IN ({tanks_str})
-AND t.GASNUM IN ({gasnums_str})
-"""
-
-try:
-    oracle_df = pd.read_sql(oracle_query_current, con=oracle_engine)
+def volume_lookup(df):
+    """Словарь {(OBJECTCODE, GASNUM, TANK): VOLUME} для поиска без фильтрации DataFrame"""
+    return {
+        (str(object_code), str(gasnum), int(tank)): volume
+        for object_code, gasnum, tank, volume in zip(df['OBJECTCODE'], df['GASNUM'], df['TANK'], df['VOLUME'])
+    }
+
+def load_volumes(snapshot=None):
+    """Текущие объёмы и средние за 30 дней для резервуаров без свежего замера"""
+    print("📊 Загрузка текущих объемов из Oracle...")
+    if snapshot is not None:
+        oracle_df = snapshot.current_volumes(params_list)
+    else:
+        oracle_df = data_source.read_current_volumes(params_list, FORECAST_DATE)
     print(f"✅ Текущие объемы из BI.tigmeasurements загружены: {len(oracle_df)} записей")
-except Exception as e:
-    logging.error(f"Ошибка при чтении текущих объемов из Oracle: {e}")
-    print(f"❌ Ошибка при чтении текущих объемов из Oracle: {e}")
-    sys.exit(1)
 
-# Приводим названия к верхнему регистру для удобства
-oracle_df.columns = [col.upper() for col in oracle_df.columns]
-oracle_df['GASNUM'] = oracle_df['GASNUM'].astype(str)
+    # Приводим названия к верхнему регистру для удобства
+    oracle_df.columns = [col.upper() for col in oracle_df.columns]
+    oracle_df['GASNUM'] = oracle_df['GASNUM'].astype(str)
+    current = volume_lookup(oracle_df)
+
+    return current, load_fallback_volumes(current, FORECAST_DATE)
+
+def load_fallback_volumes(current, forecast_date):
+    """
+    Резервуары без свежего замера: среднее за последние 30 дней одним запросом на все,
+    чтобы рабочие потоки не ходили в Oracle по одному резервуару
+    """
+    missing_keys = [normalize_key(k) for k in params_list if normalize_key(k) not in current]
+    if not missing_keys:
+        return {}
+    print(f"📊 Нет свежего замера для {len(missing_keys)} резервуаров на {forecast_date}, загрузка средних за 30 дней...")
+    try:
+        fallback = volume_lookup(data_source.read_fallback_volumes(missing_keys, forecast_date))
+        print(f"✅ Средние объёмы загружены: {len(fallback)} из {len(missing_keys)}")
+        return fallback
+    except Exception as e:
+        logging.error(f"Ошибка запроса fallback к Oracle: {e}")
+        print(f"❌ Ошибка запроса fallback к Oracle: {e}")
+        return {}
+
+def load_backfill_volumes(forecast_dates):
+    """
+    Объёмы на каждую дату бэкфилла: текущие — из одной выгрузки замеров за дни диапазона,
+    средние за 30 дней — агрегатом на стороне Oracle только по резервуарам без замера
+    """
+    print(f"📊 Загрузка замеров из Oracle за {forecast_dates[0]} - {forecast_dates[-1]}...")
+    history = MeasurementHistory.load(data_source.read_measurements, unique_objcodes, forecast_dates[0], forecast_dates[-1])
+    print(f"✅ Замеры для бэкфилла загружены: {len(history.rows)} записей")
+
+    volumes = {}
+    for forecast_date in forecast_dates:
+        current = volume_lookup(history.current_volumes(params_list, forecast_date))
+        print(f"   {forecast_date}: текущих объёмов {len(current)} из {len(params_list)}")
+        volumes[forecast_date] = (current, load_fallback_volumes(current, forecast_date))
+    return volumes
+
+def load_prophet():
+    """Класс Prophet; импорт prophet (cmdstanpy, matplotlib) занимает секунды"""
+    return profiler.import_module('prophet').Prophet
 
 #######################################################################
 # 10. Определяем функцию обработки одной комбинации (Prophet)
 #######################################################################
-def find_similar_days(target_weekday, target_hour, data, window_size=7):
-    """Функция для поиска похожих дней (weekday + hour) в исторических данных."""
-    similar_days = data[
-        (data['weekday'] == target_weekday) &
-        (data['ds'].dt.hour == target_hour)
-    ]
-    if not similar_days.empty:
-        rolling_mean = (similar_days['RECEIPTS_VOLUME']
-                        .rolling(window=window_size, min_periods=1)
-                        .mean()
-                        .iloc[-1])
-    else:
-        rolling_mean = data['RECEIPTS_VOLUME'].mean()
-    return rolling_mean
-
-def process_combination(group_key):
+def process_combination(group_key, history, profile=None, forecast_date=None, forecast_hours=None):
+    """
+    Прогноз и момент достижения мёртвого остатка для одной комбинации и даты.
+    history — (первый час, объёмы по часам) из history_window: пропуски уже заполнены,
+    а часы ограничены горизонтом обучения и датой прогноза.
+    profile — скользящее среднее последних 7 значений по слотам [день недели, час]
+    этой истории (series_profiles), NaN — слот без истории. Без profile он считается
+    здесь по одной истории.
+    """
     object_code, tank_number, gasnum_str = group_key
-    
-    # Находим все возможные типы топлива для данного GASNUM
-    possible_fuels = [k for k, v in fuel_mapping.items() if v == gasnum_str]
-    if not possible_fuels:
-        print(f"❌ Не найден вид топлива для GASNUM {gasnum_str}")
-        return None
-        
-    # Пробуем найти строку в city_data для каждого возможного типа топлива
-    dead_stock_row = None
-    for fuel_name in possible_fuels:
-        temp_row = city_data[
-            (city_data['OBJECTCODE'] == object_code) &
-            (city_data['TANK'] == tank_number) &
-            (city_data['FuelType'] == fuel_name)
-        ]
-        if not temp_row.empty:
-            dead_stock_row = temp_row
-            break
-            
-    if dead_stock_row is None or dead_stock_row.empty:
-        print(f"❌ Не найден мёртвый остаток для OBJECTCODE={object_code}, TANK={tank_number}, возможные типы топлива: {possible_fuels}")
-        return None
-
-    # Получим «человеческое» название топлива (если нужно для отладки)
-    fuel_name = None
-    for k, v in fuel_mapping.items():
-        if v == gasnum_str:
-            fuel_name = k
-            break
-
-    if not fuel_name:
-        print(f"❌ Не найден FuelType для GASNUM={gasnum_str}, пропускаем.")
+    forecast_date = forecast_date or FORECAST_DATE
+    forecast_hours = forecast_hours or FORECAST_HOURS
+    if profile is None:
+        profile = series_profiles([history])[0]
+
+    # Мёртвый остаток, вид топлива и объёмы резервуара — из реестра по ключу
+    tank_record = tank_registry.get(object_code, tank_number, gasnum_str)
+    if tank_record is None:
+        print(f"❌ Не найден мёртвый остаток для OBJECTCODE={object_code}, TANK={tank_number}, GASNUM={gasnum_str}")
         return None
 
+    fuel_name = tank_record.fuel_name
     print(f"\n🔄 Обработка: OBJECTCODE={object_code}, TANK={tank_number}, Fuel={fuel_name}")
 
-    # Берём строку из city_data, где хранятся мёртвые остатки
-    dead_row = city_data[
-        (city_data['OBJECTCODE'] == object_code) &
-        (city_data['TANK'] == tank_number) &
-        (city_data['FuelType'] == fuel_name)
-    ]
-    if dead_row.empty:
-        print("❌ Не найден мёртвый остаток в CSV для этой комбинации.")
-        return None
-
-    dead_stock = dead_row['Volume_liters'].iloc[0]
+    dead_stock = tank_record.deadstock_volume
     print(f"📍 Мёртвый остаток: {dead_stock}")
 
-    # Текущий объём из oracle_df
-    current_volume_row = oracle_df[
-        (oracle_df['OBJECTCODE'] == object_code) &
-        (oracle_df['TANK'] == tank_number) &
-        (oracle_df['GASNUM'] == gasnum_str)
-    ]
-    if current_volume_row.empty:
-        # Если нет свежего объёма, берём среднее за последние 30 дней (fallback)
-        fallback_query = f"""
-        SELECT OBJECTCODE, TANK, GASNUM, AVG(VOLUME) AS VOLUME
-        FROM BI.tigmeasurements
-        WHERE 
-            POSTIMESTAMP < TO_DATE('{FORECAST_DATE} 23:59:59','YYYY-MM-DD HH24:MI:SS')
-            AND TRUNC(POSTIMESTAMP) >= TO_DATE('{FORECAST_DATE}','YYYY-MM-DD') - 30
-            AND OBJECTCODE='{object_code}'
-            AND TANK={tank_number}
-            AND GASNUM='{gasnum_str}'
-        GROUP BY OBJECTCODE, TANK, GASNUM
-        """
-        try:
-            fallback_df = pd.read_sql(fallback_query, con=oracle_engine)
-            if not fallback_df.empty:
-                initial_volume = fallback_df['VOLUME'].iloc[0]
-                print(f"⚠️ Текущий объём не найден, используем средний: {initial_volume}")
-            else:
-                print("❌ Нет данных для среднего объёма, пропускаем.")
-                return None
-        except Exception as e:
-            logging.error(f"Ошибка запроса fallback к Oracle: {e}")
-            return None
+    # Текущий объём; если нет свежего замера — среднее за последние 30 дней (fallback)
+    initial_volume, is_fallback = tank_record.initial_volume(forecast_date)
+    if initial_volume is None:
+        print("❌ Нет данных для среднего объёма, пропускаем.")
+        return None
+    if is_fallback:
+        print(f"⚠️ Текущий объём не найден, используем средний: {initial_volume}")
     else:
-        initial_volume = current_volume_row['VOLUME'].iloc[0]
         print(f"📊 Текущий объём: {initial_volume}")
 
-    # Забираем исторические продажи
-    df_temp = grouped.get_group((object_code, tank_number, gasnum_str)).copy()
-    # Суммируем, если вдруг дубликаты по одному часу
-    df_temp = df_temp.groupby('ds', as_index=False).agg({
-        'RECEIPTS_VOLUME': 'sum', 
-        'weekday': 'first'
+    # Исторические продажи: строка матрицы на полной часовой сетке
+    if history is None:
+        print("❌ Нет исторических данных в горизонте обучения.")
+        return None
+    history_first_hour, volumes = history
+    history_index = pd.date_range(start=history_first_hour, periods=len(volumes), freq='h')
+    historical_df = pd.DataFrame({
+        'ds': history_index,
+        'RECEIPTS_VOLUME': volumes,
+        'weekday': history_index.weekday
     })
 
-    # Создаём полный часовой индекс
-    df_temp = df_temp.set_index('ds')
-    start_date = df_temp.index.min().normalize()
-    end_date = df_temp.index.max().normalize() + pd.Timedelta(days=1)
-    full_index = pd.date_range(start=start_date, end=end_date, freq='h')
-
-    # Ресемплим
-    df_temp = df_temp.reindex(full_index).reset_index()
-    df_temp.rename(columns={'index': 'ds'}, inplace=True)
-    df_temp['weekday'] = df_temp['weekday'].fillna(df_temp['ds'].dt.weekday)
-    df_temp.set_index('ds', inplace=True)
-
-    # Заполнение пропусков
-    if df_temp['RECEIPTS_VOLUME'].isnull().any():
-        df_temp['RECEIPTS_VOLUME'] = df_temp['RECEIPTS_VOLUME'].interpolate(method='time')
-        df_temp['RECEIPTS_VOLUME'] = df_temp['RECEIPTS_VOLUME'].bfill().ffill()
-
-    df_temp.reset_index(inplace=True)
-    forecast_date_cutoff = pd.to_datetime(f"{FORECAST_DATE} 00:00:00")
-    historical_df = df_temp[df_temp['ds'] < forecast_date_cutoff]
-
     prophet_df = historical_df[['ds', 'RECEIPTS_VOLUME']].rename(columns={'RECEIPTS_VOLUME': 'y'})
     prophet_df = prophet_df[prophet_df['y'] >= 0]
 
@@ -793,6 +1253,7 @@ def process_combination(group_key):
         return None
 
     # Создаём и обучаем модель
+    Prophet = load_prophet()
     model = Prophet(
         seasonality_mode='additive',
         yearly_seasonality=False,
@@ -811,21 +1272,22 @@ def process_combination(group_key):
         logging.error(f"Ошибка обучения Prophet: {e}")
         return None
 
-    # Прогноз на FORECAST_HOURS часов (динамически, в зависимости от дня недели)
-    forecast_start_date = pd.to_datetime(f"{FORECAST_DATE} 00:00:00")
-    forecast_end_date   = forecast_start_date + pd.Timedelta(hours=FORECAST_HOURS)
+    # Прогноз на forecast_hours часов (динамически, в зависимости от дня недели)
+    forecast_start_date = pd.to_datetime(f"{forecast_date} 00:00:00")
+    forecast_end_date   = forecast_start_date + pd.Timedelta(hours=forecast_hours)
     future_dates        = pd.date_range(start=forecast_start_date, end=forecast_end_date, freq='h')
 
     future_df = pd.DataFrame({'ds': future_dates})
     forecast = model.predict(future_df)[['ds','yhat']]
     forecast['yhat'] = forecast['yhat'].clip(lower=0)
 
-    # Скользящее среднее
+    # Скользящее среднее похожих часов (тот же день недели и час) — выборка из готового профиля;
+    # для слотов без истории берём среднее по всей истории
     forecast['weekday'] = forecast['ds'].dt.weekday
     forecast['hour']    = forecast['ds'].dt.hour
-    forecast['rolling_mean'] = forecast.apply(
-        lambda row: find_similar_days(row['weekday'], row['hour'], historical_df),
-        axis=1
+    rolling_mean = profile[forecast['weekday'].to_numpy(), forecast['hour'].to_numpy()]
+    forecast['rolling_mean'] = np.where(
+        np.isnan(rolling_mean), historical_df['RECEIPTS_VOLUME'].mean(), rolling_mean
     )
 
     # Предположим, вы хотите нижнюю границу в 20% от среднего Rolling Mean:
@@ -889,7 +1351,7 @@ def process_combination(group_key):
         print(f"⚠️ Deadstock достигнут: {deadstock_date}")
     else:
         deadstock_date = None
-        print(f"✅ Deadstock не достигнут в горизонте {FORECAST_HOURS+1} часов.")
+        print(f"✅ Deadstock не достигнут в горизонте {forecast_hours+1} часов.")
 
     # Формируем DataFrame для вставки
     forecast['objectcode'] = object_code
@@ -910,108 +1372,301 @@ def process_combination(group_key):
 #######################################################################
 # 11. Основной блок исполнения + вставка в ord_forecast
 #######################################################################
-if __name__ == '__main__':
+def run_pipeline(args, forecast_plan):
+    """
+    Разделы 4-11 для дат forecast_plan — списка (дата прогноза, горизонт в часах).
+    Одна дата — обычный запуск, несколько — бэкфилл с одной загрузкой истории.
+    Возвращает код завершения.
+    """
+    global city_data, unique_objcodes, fetch_stage, params_list, object_codes, gasnums, tanks
+    global tank_registry
+
+    try:
+        city_data = read_deadstock_catalog(args.city, args.branch)
+    except Exception as e:
+        logging.error(f"Ошибка при чтении CSV файла: {e}")
+        print(f"❌ Ошибка при чтении CSV файла: {e}")
+        return EXIT_FAILURE
+
+    # Проверка, есть ли данные для обработки
+    if city_data.empty:
+        print(f"❌ Нет данных для городов {args.city or []} или веток {args.branch or []} в CSV. Останавливаем скрипт.")
+        return EXIT_NO_DATA
+
+    profiler.checkpoint('4. чтение CSV с мёртвыми остатками')
+
+    # Собираем список уникальных OBJECTCODE из CSV
+    unique_objcodes = city_data['OBJECTCODE'].unique().tolist()
+
+    # Стадия загрузки: каждый запрос стартует, как только готовы его входные данные.
+    # Статусы и снимок замеров зависят только от CSV и читаются из Oracle одновременно;
+    # объёмы резервуаров (раздел 9) дочитываются параллельно с продажами из SQL Server
+    fetch_stage = FetchStage(max_workers=FETCH_STAGE_WORKERS)
+    fetch_stage.add('statuses', lambda: data_source.read_station_statuses(unique_objcodes))
+    if USE_MEASUREMENT_SNAPSHOT and len(forecast_plan) == 1:
+        # Снимок хранит только один день; бэкфилл читает замеры за весь диапазон (раздел 9)
+        fetch_stage.add('measurements', refresh_measurement_snapshot)
+    # prophet импортируется в фоне, пока идут запросы к базам
+    fetch_stage.add('prophet', load_prophet)
+
+    try:
+        status_df = fetch_stage.result('statuses')
+        status_df.columns = [col.upper().strip() for col in status_df.columns]
+        print("✅ Список статусов АЗС загружен из Oracle.")
+    except Exception as e:
+        logging.error(f"Ошибка при чтении статусов из Oracle: {e}")
+        print(f"❌ Ошибка при чтении статусов из Oracle: {e}")
+        return EXIT_FAILURE
+
+    if status_df.empty:
+        print("❌ Не найдено никаких АЗС в Oracle по тем OBJECTCODE, что есть в CSV.")
+        return EXIT_NO_DATA
+
+    profiler.checkpoint('5. статусы АЗС (Oracle)')
+
+    city_data = filter_active_stations(city_data, status_df)
+    if city_data.empty:
+        print("❌ После фильтрации по STATUS=1 не осталось данных. Останавливаем скрипт.")
+        return EXIT_NO_DATA
+
+    city_data = prepare_tanks(city_data)
+    print(f"✅ Количество строк после подготовки и фильтрации: {len(city_data)}")
+
+    # Получаем уникальные комбинации
+    unique_combinations = city_data[['OBJECTCODE', 'TANK', 'FuelType']].drop_duplicates()
+    print(f"✅ Количество уникальных комбинаций: {len(unique_combinations)}")
+
+    params_list = build_params_list(unique_combinations)
+    object_codes = list({p[0] for p in params_list})
+    gasnums      = list({p[1] for p in params_list})
+    tanks        = list({p[2] for p in params_list})
+
+    # Реестр резервуаров: рабочие потоки берут мёртвый остаток и объём по ключу, без масок по city_data
+    tank_registry = TankRegistry(city_data, fuel_mapping)
+
+    # Объёмы грузятся в фоне; дожидаемся их вместе с первой историей продаж.
+    # Бэкфилл берёт замеры за весь диапазон дат одной выгрузкой
+    forecast_dates = [forecast_date for forecast_date, _ in forecast_plan]
+    if len(forecast_plan) > 1:
+        fetch_stage.add('volumes', lambda: load_backfill_volumes(forecast_dates))
+    elif USE_MEASUREMENT_SNAPSHOT:
+        fetch_stage.add('volumes', lambda snapshot: {FORECAST_DATE: load_volumes(snapshot)}, 'measurements')
+    else:
+        fetch_stage.add('volumes', lambda: {FORECAST_DATE: load_volumes()})
+
+    profiler.checkpoint('6-9. комбинации и запуск загрузок')
+
+    print(f"\n🚀 Начинаем обработку {len(params_list)} комбинаций на {len(forecast_plan)} дат...")
+
+    # Статистика по исходным данным собирается по мере поступления комбинаций
+    last_month = pd.to_datetime(forecast_dates[-1]) - pd.Timedelta(days=30)
+    sales_stats = {'rows': 0, 'min_ds': None, 'max_ds': None, 'dates': set(), 'recent_rows': 0, 'recent_sum': 0.0}
+
+    # История загружается один раз и раскладывается в матрицу ряд × час; пропуски
+    # заполняются пачками по SERIES_FILL_BATCH комбинаций, а каждая пара (дата, комбинация)
+    # получает срез строки матрицы. Семафор ограничивает число задач, ожидающих обработки
+    sales_matrix = build_sales_matrix(forecast_dates)
+    in_flight = threading.BoundedSemaphore(MAX_WORKERS * 2)
+    futures = []
+
+    def submit_batch(executor, group_keys):
+        sales_matrix.fill(group_keys)
+        for forecast_date, forecast_hours in forecast_plan:
+            histories = [history_window(sales_matrix, group_key, forecast_date) for group_key in group_keys]
+            # Профили день недели × час всей пачки считаются одним проходом
+            profiles = series_profiles(histories)
+            for group_key, history, profile in zip(group_keys, histories, profiles):
+                in_flight.acquire()
+                future = executor.submit(
+                    process_combination, group_key, history, profile, forecast_date, forecast_hours
+                )
+                future.add_done_callback(lambda _: in_flight.release())
+                futures.append((forecast_date, future))
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            volumes_ready = False
+            pending = []
+            for group_key, sales_df in load_sales_series():
+                if not volumes_ready:
+                    # Выгрузка продаж уже идёт — теперь дожидаемся объёмов из Oracle
+                    try:
+                        for forecast_date, (current, fallback) in fetch_stage.result('volumes').items():
+                            tank_registry.attach_volumes(forecast_date, current, fallback)
+                    except Exception as e:
+                        logging.error(f"Ошибка при чтении текущих объемов из Oracle: {e}")
+                        print(f"❌ Ошибка при чтении текущих объемов из Oracle: {e}")
+                        return EXIT_FAILURE
+                    volumes_ready = True
+
+                sales_stats['rows'] += len(sales_df)
+                series_min, series_max = sales_df['ds'].min(), sales_df['ds'].max()
+                sales_stats['min_ds'] = series_min if sales_stats['min_ds'] is None else min(sales_stats['min_ds'], series_min)
+                sales_stats['max_ds'] = series_max if sales_stats['max_ds'] is None else max(sales_stats['max_ds'], series_max)
+                sales_stats['dates'].update(sales_df['ds'].dt.normalize().unique())
+                recent = sales_df.loc[sales_df['ds'] >= last_month, 'RECEIPTS_VOLUME']
+                sales_stats['recent_rows'] += len(recent)
+                sales_stats['recent_sum'] += float(recent.sum())
+
+                sales_matrix.add(group_key, sales_df['ds'], sales_df['RECEIPTS_VOLUME'], summed=not AGGREGATE_SALES_IN_SQL)
+                pending.append(group_key)
+                if len(pending) >= SERIES_FILL_BATCH:
+                    submit_batch(executor, pending)
+                    pending = []
+            submit_batch(executor, pending)
+    except Exception as e:
+        logging.error(f"Критическая ошибка при чтении из ord_salesbyhour: {e}")
+        print(f"💥 Критическая ошибка при чтении из ord_salesbyhour: {e}")
+        return EXIT_FAILURE
+
+    results = {forecast_date: [] for forecast_date in forecast_dates}
+    for forecast_date, future in futures:
+        insert_df = future.result()
+        if insert_df is not None:
+            results[forecast_date].append(insert_df)
+    profiler.checkpoint('10-11. загрузка продаж и прогнозы')
+
     # Проверим диапазон дат в исходных данных
     print(f"\n📊 Диагностика исходных данных:")
-    print(f"   Минимальная дата в данных: {df_all['ds'].min()}")
-    print(f"   Максимальная дата в данных: {df_all['ds'].max()}")
-    print(f"   Количество уникальных дат: {df_all['ds'].dt.date.nunique()}")
-    
+    print(f"   Загружено записей: {sales_stats['rows']:,}")
+    print(f"   Минимальная дата в данных: {sales_stats['min_ds']}")
+    print(f"   Максимальная дата в данных: {sales_stats['max_ds']}")
+    print(f"   Количество уникальных дат: {len(sales_stats['dates'])}")
+
     # Проверим данные за последний месяц
-    last_month = pd.to_datetime(FORECAST_DATE) - pd.Timedelta(days=30)
-    recent_data = df_all[df_all['ds'] >= last_month]
+    recent_mean = sales_stats['recent_sum'] / sales_stats['recent_rows'] if sales_stats['recent_rows'] else float('nan')
     print(f"\n📈 Статистика за последний месяц:")
-    print(f"   Количество записей: {len(recent_data):,}")
-    print(f"   Среднее значение продаж: {recent_data['RECEIPTS_VOLUME'].mean():.2f}")
-    
-    print(f"\n🚀 Начинаем обработку {len(grouped.groups)} комбинаций...")
-    
-    # Параллельно обрабатываем каждую комбинацию (OBJECTCODE, TANK, GASNUM)
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-        results = list(executor.map(process_combination, grouped.groups.keys()))
+    print(f"   Количество записей: {sales_stats['recent_rows']:,}")
+    print(f"   Среднее значение продаж: {recent_mean:.2f}")
 
-    insert_dfs = [df for df in results if df is not None]
+    # Одна запись в ord_forecast на каждую дату; ошибка одной даты не мешает остальным
+    exit_codes = [
+        write_forecasts(forecast_date, forecast_hours, results[forecast_date], args.dry_run)
+        for forecast_date, forecast_hours in forecast_plan
+    ]
+    profiler.checkpoint('11. запись в ord_forecast')
+    if EXIT_FAILURE in exit_codes:
+        return EXIT_FAILURE
+    if EXIT_NO_DATA in exit_codes:
+        return EXIT_NO_DATA
+    return EXIT_OK
+
+def write_forecasts(forecast_date, forecast_hours, insert_dfs, dry_run=False):
+    """Замена прогнозов одной даты в ord_forecast: удаление старых и вставка новых одним пакетом"""
     if not insert_dfs:
-        print("❌ Нет данных для вставки в ord_forecast.")
-    else:
-        final_insert_df = pd.concat(insert_dfs, ignore_index=True)
+        print(f"❌ Нет данных для вставки в ord_forecast за {forecast_date}.")
+        return EXIT_NO_DATA
 
-        # Формируем временные границы для удаления старых записей
-        forecast_date    = pd.to_datetime(FORECAST_DATE)
-        forecast_start   = forecast_date.strftime('%Y-%m-%d 00:00:00')
-        forecast_end     = (forecast_date + pd.Timedelta(hours=FORECAST_HOURS)).strftime('%Y-%m-%d %H:%M:%S')
+    final_insert_df = pd.concat(insert_dfs, ignore_index=True)
 
-        print(f"\n🗑️ Удаление старых прогнозов из ord_forecast...")
-        
-        # Удаляем старые записи из ord_forecast
-        delete_query = f"""
-        DELETE FROM ord_forecast
-        WHERE
-            objectcode IN ({object_codes_str})
-            AND gasnum IN ({gasnums_str})
-            AND tank IN ({tanks_str})
-            AND date_time BETWEEN '{forecast_start}' AND '{forecast_end}'
-        """
-        
+    # Формируем временные границы для удаления старых записей
+    forecast_day     = pd.to_datetime(forecast_date)
+    forecast_start   = forecast_day.strftime('%Y-%m-%d 00:00:00')
+    forecast_end     = (forecast_day + pd.Timedelta(hours=forecast_hours)).strftime('%Y-%m-%d %H:%M:%S')
+
+    if dry_run:
+        print("\n🧪 Пробный запуск (--dry-run): ord_forecast не изменён")
+        print(f"📊 Посчитано записей: {len(final_insert_df):,}")
+        print(f"📅 Период: {forecast_start} - {forecast_end}")
+        return EXIT_OK
+
+    print(f"\n🗑️ Удаление старых прогнозов из ord_forecast...")
+
+    try:
+        # Удаляем старые записи из ord_forecast только по точным комбинациям из params_list
+        row_count = data_source.delete_forecasts(params_list, forecast_start, forecast_end)
+        print(f"✅ Удалено {row_count} старых записей из ord_forecast.")
+    except Exception as e:
+        logging.error(f"Ошибка при удалении старых записей из ord_forecast: {e}")
+        print(f"❌ Ошибка при удалении старых записей из ord_forecast: {e}")
+        return EXIT_FAILURE
+
+    print(f"\n💾 Сохранение новых прогнозов в ord_forecast...")
+
+    # Вставляем новые прогнозы с retry
+    max_retries = 3
+    for attempt in range(max_retries):
         try:
-            # Если у нас простой engine, используем PyODBC
-            if hasattr(engine, 'get_conn'):
-                conn_temp = engine.get_conn()
-                cursor = conn_temp.cursor()
-                cursor.execute(delete_query)
-                row_count = cursor.rowcount
-                conn_temp.commit()
-                cursor.close()
-                conn_temp.close()
-                print(f"✅ Удалено {row_count} старых записей из ord_forecast.")
-            else:
-                # Стандартный SQLAlchemy
-                with engine.begin() as connection:
-                    result = connection.execute(text(delete_query))
-                    print(f"✅ Удалено {result.rowcount} старых записей из ord_forecast.")
+            data_source.insert_forecasts(final_insert_df)
+
+            print(f"\n✅ Новые прогнозные данные успешно вставлены в ord_forecast!")
+            print(f"📊 Количество записей: {len(final_insert_df):,}")
+            print(f"📅 Период: {forecast_start} - {forecast_end}")
+            break
+
         except Exception as e:
-            logging.error(f"Ошибка при удалении старых записей из ord_forecast: {e}")
-            print(f"❌ Ошибка при удалении старых записей из ord_forecast: {e}")
-            sys.exit(1)
+            print(f"❌ Попытка {attempt + 1} вставки не удалась: {e}")
+            if attempt < max_retries - 1:
+                print("⏳ Ожидание 10 секунд перед повтором...")
+                time.sleep(10)
+            else:
+                logging.error(f"Ошибка при вставке данных в ord_forecast: {e}")
+                print(f"💥 Критическая ошибка при вставке данных в ord_forecast: {e}")
+                return EXIT_FAILURE
+    return EXIT_OK
+
+def main(argv=None):
+    """Точка входа: аргументы, дата прогноза, источник данных и прогноз; возвращает код завершения"""
+    global FORECAST_DATE, FORECAST_HOURS, data_source
+
+    args = parse_args(argv)
+    profiler.enabled = profiler.enabled or args.profile_startup
+
+    if args.date is not None:
+        forecast_datetime = args.date
+        if forecast_datetime < datetime.now() - timedelta(days=30):
+            print("⚠️  Выбранная дата старше 30 дней.")
+    elif sys.stdin.isatty():
+        # Выбираем дату прогноза
+        forecast_datetime = select_forecast_date()
+    else:
+        print("❌ Дата прогноза не задана: без терминала укажите --date YYYY-MM-DD или --date today")
+        return EXIT_USAGE
+
+    FORECAST_DATE = forecast_datetime.strftime("%Y-%m-%d")
+    FORECAST_HOURS, forecast_period = forecast_horizon(forecast_datetime, args.hours)
+    print_forecast_parameters(forecast_datetime, forecast_period)
+
+    forecast_plan = [(FORECAST_DATE, FORECAST_HOURS)]
+    if args.until is not None:
+        # Бэкфилл: каждый день диапазона со своим горизонтом (пятница — 71 час)
+        forecast_plan = [
+            (day.strftime("%Y-%m-%d"), forecast_horizon(day, args.hours)[0])
+            for day in pd.date_range(forecast_datetime.date(), args.until.date(), freq='D')
+        ]
+        print(f"📆 Бэкфилл: {len(forecast_plan)} дат, {forecast_plan[0][0]} - {forecast_plan[-1][0]}")
 
-        print(f"\n💾 Сохранение новых прогнозов в ord_forecast...")
-        
-        # Вставляем новые прогнозы с retry
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                # Если у нас простой engine, используем PyODBC
-                if hasattr(engine, 'get_conn'):
-                    conn_temp = engine.get_conn()
-                    final_insert_df.to_sql('ord_forecast', con=conn_temp, if_exists='append', index=False)
-                    conn_temp.close()
-                else:
-                    # Стандартный SQLAlchemy
-                    final_insert_df.to_sql('ord_forecast', con=engine, if_exists='append', index=False)
-                    
-                print(f"\n✅ Новые прогнозные данные успешно вставлены в ord_forecast!")
-                print(f"📊 Количество записей: {len(final_insert_df):,}")
-                print(f"📅 Период: {forecast_start} - {forecast_end}")
-                break
-                
-            except Exception as e:
-                print(f"❌ Попытка {attempt + 1} вставки не удалась: {e}")
-                if attempt < max_retries - 1:
-                    print("⏳ Ожидание 10 секунд перед повтором...")
-                    time.sleep(10)
-                else:
-                    logging.error(f"Ошибка при вставке данных в ord_forecast: {e}")
-                    print(f"💥 Критическая ошибка при вставке данных в ord_forecast: {e}")
+    if args.date is None:
+        # Подтверждение
+        confirm = input("\nПродолжить с этими параметрами? (y/n): ").strip().lower()
+        if confirm != 'y':
+            print("Операция отменена.")
+            return EXIT_CANCELLED
 
-    # Закрываем коннекты
+    profiler.checkpoint('1-3. выбор даты прогноза')
+
+    data_source = open_data_source()
     try:
-        if hasattr(oracle_engine, 'dispose'):
-            oracle_engine.dispose()
-        if hasattr(engine, 'dispose'):
-            engine.dispose()
-        conn.close()
-        print("\n🔒 Все подключения закрыты")
-    except Exception as e:
-        print(f"⚠️ Ошибка при закрытии подключений: {e}")
-    
-    print("\n🎉 Все операции завершены!")
+        exit_code = run_pipeline(args, forecast_plan)
+    finally:
+        # Закрываем коннекты
+        try:
+            if fetch_stage is not None:
+                fetch_stage.shutdown()
+            data_source.close()
+            print("\n🔒 Все подключения закрыты")
+        except Exception as e:
+            print(f"⚠️ Ошибка при закрытии подключений: {e}")
+
+        # Время выполнения запросов по именам
+        sql_queries.print_report()
+        oracle_queries.print_report()
+        profiler.report()
+
+    if exit_code == EXIT_OK:
+        print("\n🎉 Все операции завершены!")
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
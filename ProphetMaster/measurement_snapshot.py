@@ -0,0 +1,154 @@
+# Снимок последних замеров уровнемеров из BI.tigmeasurements с водяной меткой по ID
+import os
+import logging
+from datetime import datetime
+
+import pandas as pd
+
+from atomic_files import read_json, read_parquet, write_json, write_parquet
+
+MEASUREMENT_COLUMNS = ['ID', 'OBJECTCODE', 'TANK', 'GASNUM', 'VOLUME', 'POSTIMESTAMP']
+MEASUREMENT_KEY = ['OBJECTCODE', 'TANK', 'GASNUM']
+SNAPSHOT_NAME = 'latest.parquet'
+MANIFEST_NAME = 'snapshot.json'
+
+
+def normalize_measurements(df):
+    """Приводит строки BI.tigmeasurements к единым именам и типам колонок"""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=MEASUREMENT_COLUMNS)
+    df = df.copy()
+    df.columns = [col.upper() for col in df.columns]
+    df = df[MEASUREMENT_COLUMNS]
+    df['ID'] = df['ID'].astype('int64')
+    df['OBJECTCODE'] = df['OBJECTCODE'].astype(str)
+    df['TANK'] = df['TANK'].astype('int64')
+    df['GASNUM'] = df['GASNUM'].astype(str)
+    df['VOLUME'] = df['VOLUME'].astype('float64')
+    df['POSTIMESTAMP'] = pd.to_datetime(df['POSTIMESTAMP'])
+    return df
+
+
+def select_keys(df, keys):
+    """Строки [OBJECTCODE, TANK, GASNUM, VOLUME] только по комбинациям keys (OBJECTCODE, GASNUM, TANK)"""
+    wanted = pd.DataFrame(
+        [(str(o), int(t), str(g)) for o, g, t in keys], columns=MEASUREMENT_KEY
+    ).drop_duplicates()
+    selected = df.merge(wanted, on=MEASUREMENT_KEY, how='inner')
+    return selected[['OBJECTCODE', 'TANK', 'GASNUM', 'VOLUME']].reset_index(drop=True)
+
+
+class MeasurementSnapshot:
+    """
+    Последний замер по каждой комбинации (OBJECTCODE, TANK, GASNUM) за день прогноза.
+    Вместо MAX(ID) по всей таблице за сутки из источника дочитываются только строки
+    с ID больше водяной метки в диапазоне POSTIMESTAMP >= начало суток AND < конец суток.
+    Поздно доставленные замеры получают новый ID и поэтому тоже попадают в снимок.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        os.makedirs(self.base_dir, exist_ok=True)
+        self.snapshot_path = os.path.join(self.base_dir, SNAPSHOT_NAME)
+        self.manifest_path = os.path.join(self.base_dir, MANIFEST_NAME)
+        self.manifest = read_json(self.manifest_path, 'снимок будет перестроен')
+        self.latest = self._load_latest()
+
+    #######################################################################
+    # Хранение снимка
+    #######################################################################
+    def _load_latest(self):
+        latest = read_parquet(self.snapshot_path, 'снимок будет перестроен') if self.manifest else None
+        if latest is None:
+            # Без строк снимка водяная метка манифеста бесполезна
+            self.manifest = {}
+        return normalize_measurements(latest)
+
+    def _save(self):
+        write_parquet(self.snapshot_path, self.latest)
+        write_json(self.manifest_path, self.manifest)
+
+    def _reset(self, day, object_codes):
+        self.latest = normalize_measurements(None)
+        self.manifest = {
+            'day': day.strftime('%Y-%m-%d'),
+            'object_codes': sorted(object_codes),
+            'watermark_id': None,
+        }
+
+    #######################################################################
+    # Обновление и чтение
+    #######################################################################
+    def refresh(self, object_codes, forecast_date, fetch):
+        """
+        Дочитывает новые замеры за день forecast_date по АЗС object_codes.
+        fetch(object_codes, start, end, after_id) должен вернуть строки BI.tigmeasurements
+        с POSTIMESTAMP в [start, end) и ID > after_id (after_id=None — без ограничения).
+        """
+        day = pd.Timestamp(forecast_date).normalize()
+        object_codes = {str(code) for code in object_codes}
+        known_codes = set(self.manifest.get('object_codes', []))
+        if self.manifest.get('day') != day.strftime('%Y-%m-%d'):
+            # Новый день прогноза — снимок строится заново
+            self._reset(day, object_codes)
+        elif not object_codes <= known_codes:
+            # Появились новые АЗС — перечитываем день целиком по расширенному списку
+            self._reset(day, object_codes | known_codes)
+
+        after_id = self.manifest.get('watermark_id')
+        end = day + pd.Timedelta(days=1)
+        new_rows = normalize_measurements(fetch(sorted(self.manifest['object_codes']), day, end, after_id))
+        if not new_rows.empty:
+            combined = pd.concat([f for f in (self.latest, new_rows) if not f.empty], ignore_index=True)
+            self.latest = (
+                combined.sort_values('ID')
+                .drop_duplicates(MEASUREMENT_KEY, keep='last')
+                .reset_index(drop=True)
+            )
+            self.manifest['watermark_id'] = int(self.latest['ID'].max())
+
+        self.manifest['synced_at'] = datetime.now().isoformat(timespec='seconds')
+        try:
+            self._save()
+        except Exception as e:
+            logging.warning(f"Не удалось сохранить снимок замеров: {e}")
+        return len(new_rows)
+
+    def current_volumes(self, keys):
+        """DataFrame [OBJECTCODE, TANK, GASNUM, VOLUME] по комбинациям keys (OBJECTCODE, GASNUM, TANK)"""
+        return select_keys(self.latest, keys)
+
+
+class MeasurementHistory:
+    """
+    Замеры за диапазон дат прогноза одной выгрузкой — для бэкфилла на несколько дней.
+    Строки отсортированы по POSTIMESTAMP, поэтому окно любого дня берётся двумя
+    searchsorted без фильтрации всей таблицы. Результаты совпадают с запросом
+    current_volumes (MAX(ID) за день); средние за 30 дней для резервуаров без замера
+    считает источник (read_fallback_volumes) только по недостающим комбинациям.
+    """
+
+    def __init__(self, measurements):
+        self.rows = (
+            normalize_measurements(measurements)
+            .sort_values('POSTIMESTAMP', kind='stable')
+            .reset_index(drop=True)
+        )
+
+    @classmethod
+    def load(cls, fetch, object_codes, first_date, last_date):
+        """Замеры за дни first_date..last_date"""
+        first_day = pd.Timestamp(first_date).normalize()
+        end = pd.Timestamp(last_date).normalize() + pd.Timedelta(days=1)
+        return cls(fetch(sorted({str(code) for code in object_codes}), first_day, end))
+
+    def _window(self, start, end):
+        lo, hi = self.rows['POSTIMESTAMP'].searchsorted([start, end])
+        return self.rows.iloc[lo:hi]
+
+    def current_volumes(self, keys, forecast_date):
+        """Последний (по ID) замер каждой комбинации за день forecast_date"""
+        day = pd.Timestamp(forecast_date).normalize()
+        window = self._window(day, day + pd.Timedelta(days=1))
+        latest = window.sort_values('ID').drop_duplicates(MEASUREMENT_KEY, keep='last')
+        return select_keys(latest, keys)
@@ -0,0 +1,123 @@
+# Пул подключений PyODBC для запасного пути подключения к SQL Server (SimpleEngine)
+import time
+import queue
+import logging
+import threading
+
+
+class PooledConnection:
+    """Обёртка над подключением из пула: close() возвращает его в пул, а не закрывает"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._pool.release(self._conn)
+
+
+class PyodbcPool:
+    """
+    Ограниченный потокобезопасный пул подключений pyodbc.
+    Не больше max_size подключений одновременно; перед выдачей подключение, простоявшее
+    дольше ping_after секунд, проверяется SELECT 1, а простоявшее дольше recycle_seconds
+    закрывается и заменяется новым. Возвращаемое подключение откатывает незавершённую
+    транзакцию, поэтому следующий пользователь получает его в чистом состоянии.
+    """
+
+    def __init__(self, connection_string, max_size=4, timeout=30, ping_after=30, recycle_seconds=600):
+        self.connection_string = connection_string
+        self.max_size = max_size
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.recycle_seconds = recycle_seconds
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._closed = False
+
+    def _connect(self):
+        import pyodbc
+
+        return pyodbc.connect(self.connection_string, timeout=self.timeout)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_alive(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception as e:
+            logging.warning(f"Подключение из пула не прошло проверку, будет пересоздано: {e}")
+            return False
+
+    def _take_idle(self):
+        """Свободное живое подключение из пула или None"""
+        while True:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            idle_for = time.monotonic() - idle_since
+            if idle_for > self.recycle_seconds:
+                self._close_quietly(conn)
+                continue
+            if idle_for > self.ping_after and not self._is_alive(conn):
+                self._close_quietly(conn)
+                continue
+            return conn
+
+    def acquire(self):
+        """Подключение из пула; ждёт освобождения слота не дольше timeout секунд"""
+        if self._closed:
+            raise RuntimeError("Пул подключений закрыт")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"Нет свободного подключения в пуле за {self.timeout} с")
+        try:
+            conn = self._take_idle() or self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        try:
+            if self._closed:
+                self._close_quietly(conn)
+                return
+            try:
+                conn.rollback()
+                self._idle.put((conn, time.monotonic()))
+            except Exception:
+                # Подключение сломано — просто выбрасываем его, слот освобождается
+                self._close_quietly(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close_quietly(conn)
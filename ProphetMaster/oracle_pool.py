@@ -0,0 +1,69 @@
+# Ленивый пул сессий Oracle (python-oracledb)
+import os
+import logging
+import threading
+
+
+class OraclePool:
+    """
+    Пул сессий python-oracledb, создаваемый при первом обращении.
+    Толстый режим включается только если папка Instant Client существует,
+    иначе используется тонкий режим без клиентских библиотек.
+    Запросы берут сессию через acquire() и выполняются QueryLayer с bind-переменными,
+    поэтому сессии и кэш операторов переиспользуются между запросами.
+    oracledb импортируется тоже при первом обращении.
+    """
+
+    def __init__(self, user, password, host, port, service_name,
+                 min_sessions=1, max_sessions=4, stmt_cache_size=40, lib_dir=None):
+        self.user = user
+        self.password = password
+        self.dsn = f"{host}:{port}/{service_name}"
+        self.min_sessions = min_sessions
+        self.max_sessions = max(max_sessions, min_sessions)
+        self.stmt_cache_size = stmt_cache_size
+        self.lib_dir = lib_dir
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _init_client(self):
+        """Толстый режим, если есть Instant Client; повторный вызов init_oracle_client не нужен"""
+        import oracledb
+
+        if not oracledb.is_thin_mode():
+            return
+        if self.lib_dir and os.path.isdir(self.lib_dir):
+            oracledb.init_oracle_client(lib_dir=self.lib_dir)
+            print(f"🔧 Oracle: толстый режим, Instant Client {self.lib_dir}")
+        else:
+            print("🔧 Oracle: тонкий режим (Instant Client не найден)")
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    import oracledb
+
+                    self._init_client()
+                    self._pool = oracledb.create_pool(
+                        user=self.user,
+                        password=self.password,
+                        dsn=self.dsn,
+                        min=self.min_sessions,
+                        max=self.max_sessions,
+                        increment=1,
+                        getmode=oracledb.POOL_GETMODE_WAIT,
+                        stmtcachesize=self.stmt_cache_size,
+                    )
+                    logging.info(f"Создан пул Oracle {self.dsn}: {self.min_sessions}-{self.max_sessions} сессий")
+        return self._pool
+
+    def acquire(self):
+        """Сессия из пула; close() возвращает её обратно"""
+        return self.pool.acquire()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close(force=True)
+            self._pool = None
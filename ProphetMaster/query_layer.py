@@ -0,0 +1,182 @@
+# Слой запросов с bind-переменными и замером времени по каждому запросу
+import re
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+DEFAULT_BATCH_ROWS = 50000
+MIN_LIST_BINDS = 8
+MAX_LIST_BINDS = 1000  # предел Oracle на число выражений в IN
+
+
+def bind_list_size(count):
+    """Размер списка bind-переменных: ближайшая степень двойки, не меньше MIN_LIST_BINDS"""
+    size = MIN_LIST_BINDS
+    while size < count:
+        size *= 2
+    return min(size, max(count, MAX_LIST_BINDS))
+
+
+class StatementStats:
+    """Накопленная статистика одного именованного запроса"""
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds, rows):
+        self.calls += 1
+        self.rows += rows
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+class QueryLayer:
+    """
+    Именованные запросы с постоянным текстом SQL: значения передаются только через
+    bind-переменные, поэтому сервер переиспользует планы, а драйвер — подготовленные
+    операторы (кэш операторов python-oracledb, повторный prepare в pyodbc не нужен).
+    paramstyle — 'named' (Oracle, :name) или 'qmark' (SQL Server, ?).
+    Списки значений для IN (только 'named') разворачиваются в :name_0..:name_N, где N —
+    степень двойки: лишние места заполняются последним значением, и на каждый запрос
+    приходится всего несколько вариантов текста.
+    """
+
+    def __init__(self, name, paramstyle='qmark'):
+        self.name = name
+        self.paramstyle = paramstyle
+        self.statements = {}
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, sql):
+        self.statements[name] = sql.strip()
+
+    #######################################################################
+    # Подготовка запроса
+    #######################################################################
+    def _expand_lists(self, sql, params, lists):
+        if not lists:
+            return sql, params
+        if self.paramstyle != 'named':
+            raise ValueError("Списки bind-переменных поддерживаются только для paramstyle='named'")
+        params = dict(params or {})
+        for list_name, values in lists.items():
+            values = list(values) or [None]
+            size = bind_list_size(len(values))
+            values = values + [values[-1]] * (size - len(values))
+            names = [f"{list_name}_{i}" for i in range(size)]
+            sql = re.sub(rf":{list_name}\b", ', '.join(f":{n}" for n in names), sql)
+            params.update(zip(names, values))
+        return sql, params
+
+    def _prepare(self, name, params, lists):
+        sql, params = self._expand_lists(self.statements[name], params, lists)
+        if params is None:
+            params = {} if self.paramstyle == 'named' else ()
+        return sql, params
+
+    def _record(self, name, seconds, rows):
+        with self._lock:
+            self.stats.setdefault(name, StatementStats()).add(seconds, rows)
+
+    @contextmanager
+    def timed(self, name):
+        """Замер произвольного блока под именем запроса; в блок передаётся счётчик строк"""
+        counter = {'rows': 0}
+        started = time.perf_counter()
+        try:
+            yield counter
+        finally:
+            self._record(name, time.perf_counter() - started, counter['rows'])
+
+    #######################################################################
+    # Выполнение
+    #######################################################################
+    def read(self, conn, name, params=None, lists=None):
+        """Результат запроса одним DataFrame"""
+        sql, params = self._prepare(name, params, lists)
+        with self.timed(name) as counter:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                columns = [column[0] for column in cursor.description]
+                df = pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+            finally:
+                cursor.close()
+            counter['rows'] = len(df)
+        return df
+
+    def iter_read(self, conn, name, params=None, lists=None, batch_size=DEFAULT_BATCH_ROWS):
+        """Результат запроса порциями DataFrame по batch_size строк"""
+        sql, params = self._prepare(name, params, lists)
+        with self.timed(name) as counter:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                columns = [column[0] for column in cursor.description]
+                chunks = (
+                    pd.DataFrame.from_records(rows, columns=columns)
+                    for rows in iter(lambda: cursor.fetchmany(batch_size), [])
+                )
+                for chunk in chunks:
+                    counter['rows'] += len(chunk)
+                    yield chunk
+            finally:
+                cursor.close()
+
+    def execute(self, conn, name, params=None, lists=None):
+        """Выполнение без результата; возвращает число затронутых строк"""
+        sql, params = self._prepare(name, params, lists)
+        with self.timed(name) as counter:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                counter['rows'] = max(cursor.rowcount, 0)
+            finally:
+                cursor.close()
+        return counter['rows']
+
+    def executemany(self, conn, name, rows):
+        """Массовая вставка одним массивом параметров (array bind)"""
+        rows = list(rows)
+        if not rows:
+            return 0
+        sql = self.statements[name]
+        with self.timed(name) as counter:
+            cursor = conn.cursor()
+            try:
+                if hasattr(cursor, 'fast_executemany'):
+                    # pyodbc: весь массив параметров уходит на сервер одним пакетом
+                    cursor.fast_executemany = True
+                cursor.executemany(sql, rows)
+                counter['rows'] = len(rows)
+            finally:
+                cursor.close()
+        return counter['rows']
+
+    #######################################################################
+    # Отчёт
+    #######################################################################
+    def report(self):
+        """DataFrame со статистикой запросов, самые долгие сверху"""
+        with self._lock:
+            rows = [
+                (name, s.calls, s.rows, s.total_seconds, s.total_seconds / s.calls, s.max_seconds)
+                for name, s in self.stats.items()
+            ]
+        df = pd.DataFrame(rows, columns=['statement', 'calls', 'rows', 'total_s', 'avg_s', 'max_s'])
+        return df.sort_values('total_s', ascending=False).reset_index(drop=True)
+
+    def print_report(self):
+        df = self.report()
+        if df.empty:
+            return
+        print(f"\n⏱️ Запросы {self.name}:")
+        print(df.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+        logging.info(f"Запросы {self.name}:\n{df.to_string(index=False)}")
@@ -0,0 +1,196 @@
+# Локальное колоночное хранилище истории продаж из ord_salesbyhour
+import os
+import logging
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from atomic_files import read_json, write_json, write_parquet
+
+SALES_COLUMNS = ['DATE', 'R_HOUR', 'OBJECTCODE', 'GASNUM', 'TANK', 'RECEIPTS_VOLUME']
+KEY_COLUMNS = ['OBJECTCODE', 'GASNUM', 'TANK']
+MANIFEST_NAME = 'watermarks.json'
+
+
+def normalize_key(key):
+    """Приводит ключ (OBJECTCODE, GASNUM, TANK) к единому виду (str, str, int)"""
+    object_code, gasnum, tank = key
+    return str(object_code), str(gasnum), int(tank)
+
+
+def normalize_sales_frame(df, categories=None):
+    """
+    Приводит сырые строки ord_salesbyhour к компактным типам: OBJECTCODE/GASNUM —
+    категории, час — int8, резервуар — int16, объём — float32.
+    categories ({'OBJECTCODE': [...], 'GASNUM': [...]}) фиксирует набор категорий,
+    чтобы порции потоковой загрузки склеивались без возврата к object.
+    """
+    if df is None or df.empty:
+        return pd.DataFrame(columns=SALES_COLUMNS)
+    categories = categories or {}
+    df = df[SALES_COLUMNS].copy()
+    df['DATE'] = pd.to_datetime(df['DATE'], errors='coerce')
+    df['R_HOUR'] = df['R_HOUR'].astype('int8')
+    for column in ('OBJECTCODE', 'GASNUM'):
+        values = df[column].astype(str)
+        if column in categories:
+            df[column] = pd.Categorical(values, categories=categories[column])
+        else:
+            df[column] = values.astype('category')
+    df['TANK'] = df['TANK'].astype('int16')
+    df['RECEIPTS_VOLUME'] = df['RECEIPTS_VOLUME'].astype('float32')
+    return df
+
+
+def split_by_key(df):
+    """Разбивает строки продаж на (ключ, DataFrame) по комбинациям (OBJECTCODE, GASNUM, TANK)"""
+    if df is None or df.empty:
+        return
+    for key, part in df.groupby(KEY_COLUMNS, sort=False, observed=True):
+        yield normalize_key(key), part
+
+
+class SalesHistoryStore:
+    """
+    История продаж по каждой комбинации (OBJECTCODE, GASNUM, TANK) в отдельном Parquet-файле.
+    Для каждой комбинации хранится водяная метка (последние r_day/r_hour), поэтому
+    из SQL Server дочитываются только новые строки плюс окно повторного чтения
+    для поздних корректировок. Хранится и нижняя граница — начало истории, с которым
+    комбинация загружалась целиком: если запуску нужна более ранняя история (более
+    ранний --date или больший HISTORY_DAYS), комбинация загружается заново.
+    """
+
+    def __init__(self, base_dir, reread_days=3):
+        self.base_dir = base_dir
+        self.reread_days = reread_days
+        os.makedirs(self.base_dir, exist_ok=True)
+        self.manifest_path = os.path.join(self.base_dir, MANIFEST_NAME)
+        self.manifest = read_json(self.manifest_path, 'кэш будет перестроен')
+
+    #######################################################################
+    # Файлы кэша
+    #######################################################################
+    @staticmethod
+    def _key_id(key):
+        return '|'.join(str(part) for part in key)
+
+    def _path(self, key):
+        object_code, gasnum, tank = key
+        return os.path.join(self.base_dir, f"{object_code}_{tank}_{gasnum}.parquet")
+
+    def watermark(self, key):
+        """Водяная метка комбинации: datetime последнего (r_day, r_hour) или None"""
+        entry = self.manifest.get(self._key_id(key))
+        if not entry or not os.path.exists(self._path(key)):
+            return None
+        return datetime.strptime(entry['r_day'], '%Y-%m-%d') + timedelta(hours=entry['r_hour'])
+
+    def covers(self, key, history_start):
+        """
+        Есть ли в кэше история комбинации начиная с history_start (None — вся история).
+        Записи без нижней границы (кэш прежнего формата) считаются неполными.
+        """
+        entry = self.manifest.get(self._key_id(key))
+        if not entry or 'history_start' not in entry:
+            return False
+        cached_start = entry['history_start']
+        if cached_start is None:
+            return True
+        if history_start is None:
+            return False
+        return pd.Timestamp(cached_start) <= pd.Timestamp(history_start).normalize()
+
+    def load(self, key):
+        """Читает сохранённую историю одной комбинации"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=SALES_COLUMNS)
+        return pd.read_parquet(path)
+
+    def _write(self, key, df, history_start):
+        write_parquet(self._path(key), df)
+
+        last = df.sort_values(['DATE', 'R_HOUR']).iloc[-1]
+        self.manifest[self._key_id(key)] = {
+            'r_day': last['DATE'].strftime('%Y-%m-%d'),
+            'r_hour': int(last['R_HOUR']),
+            'history_start': history_start,
+            'rows': len(df),
+            'synced_at': datetime.now().isoformat(timespec='seconds'),
+        }
+
+    def _merge_one(self, key, new_rows, since, history_start):
+        """
+        Заменяет в кэше строки комбинации начиная с since свежими данными из SQL Server.
+        since=None — полная загрузка с history_start, которое запоминается нижней границей
+        """
+        if since is not None:
+            old_rows = self.load(key)
+            old_rows = old_rows[old_rows['DATE'] < pd.Timestamp(since)]
+            frames = [f for f in (old_rows, new_rows) if f is not None and not f.empty]
+            combined = pd.concat(frames, ignore_index=True) if frames else None
+            # Догрузка не меняет нижнюю границу
+            history_start = self.manifest[self._key_id(key)]['history_start']
+        else:
+            combined = new_rows
+            if history_start is not None:
+                history_start = pd.Timestamp(history_start).strftime('%Y-%m-%d')
+
+        if combined is None or combined.empty:
+            return None
+
+        combined = normalize_sales_frame(combined)
+        combined = combined.sort_values(['DATE', 'R_HOUR']).reset_index(drop=True)
+        try:
+            self._write(key, combined, history_start)
+        except Exception as e:
+            logging.warning(f"Не удалось сохранить историю {key} в кэш: {e}")
+        return combined
+
+    def _merge_iter(self, keys, parts, since, history_start):
+        """Сливает поток (ключ, новые строки) с кэшем; комбинации без новых строк берутся из кэша"""
+        wanted = set(keys)
+        seen = set()
+        for key, new_rows in parts:
+            key = normalize_key(key)
+            if key not in wanted or key in seen:
+                continue
+            seen.add(key)
+            combined = self._merge_one(key, new_rows, since, history_start(key))
+            if combined is not None:
+                yield key, combined
+
+        for key in keys:
+            if key not in seen:
+                combined = self._merge_one(key, None, since, history_start(key))
+                if combined is not None:
+                    yield key, combined
+
+    #######################################################################
+    # Синхронизация
+    #######################################################################
+    def sync_iter(self, keys, fetch_iter, history_start=lambda key: None):
+        """
+        Потоковая синхронизация: отдаёт (ключ, полная история) по мере готовности комбинаций.
+        fetch_iter(keys, since) должен отдавать пары (ключ, строки ord_salesbyhour) для
+        указанных комбинаций, начиная с даты since (или с начала их истории, если since=None).
+        history_start(key) — начало истории, которое fetch_iter отдаёт при since=None
+        (None — вся история); комбинации, чей кэш начинается позже, загружаются заново.
+        """
+        keys = sorted({normalize_key(k) for k in keys})
+        cached = {k for k in keys if self.watermark(k) is not None and self.covers(k, history_start(k))}
+        fresh_keys = [k for k in keys if k not in cached]
+        cached_keys = [k for k in keys if k in cached]
+
+        try:
+            if fresh_keys:
+                print(f"📦 Кэш истории: {len(fresh_keys)} новых или неполных комбинаций, полная загрузка...")
+                yield from self._merge_iter(fresh_keys, fetch_iter(fresh_keys, None), None, history_start)
+
+            if cached_keys:
+                oldest_mark = min(self.watermark(k) for k in cached_keys)
+                since = (oldest_mark - timedelta(days=self.reread_days)).date()
+                print(f"📦 Кэш истории: {len(cached_keys)} комбинаций, догрузка с {since}...")
+                yield from self._merge_iter(cached_keys, fetch_iter(cached_keys, since), since, history_start)
+        finally:
+            write_json(self.manifest_path, self.manifest)
@@ -0,0 +1,40 @@
+# Общая подготовка часовых продаж: метки времени арифметикой над datetime64 и компактные типы
+import numpy as np
+import pandas as pd
+
+
+def hourly_timestamps(dates, hours, rollover=True):
+    """
+    Метки времени «дата + час» для целых столбцов сразу, без strftime, склейки строк
+    и повторного разбора pd.to_datetime.
+    rollover=True — часы в исходных данных идут от 1 до 24: час 24 (и 0, как в прежнем
+    переносе) означает полночь следующих суток. При rollover=False перенос уже выполнен
+    (агрегированный запрос к ord_salesbyhour) и час прибавляется как есть.
+    """
+    dates = pd.to_datetime(pd.Series(dates), errors='coerce')
+    hours = np.asarray(hours, dtype='int64')
+    if rollover:
+        hours = np.where(hours == 0, 24, hours)
+    days = dates.dt.normalize().to_numpy()
+    return pd.Series(days + hours.astype('timedelta64[h]'), index=dates.index)
+
+
+def ingest_sales(df, date_column, hour_column, volume_column, key_columns=(),
+                 rollover=True, date_format=None):
+    """
+    Компактный часовой фрейм продаж из выгрузки ord_salesbyhour или CSV по АЗС.
+    Добавляет ds и weekday (int8), разбирает date_column (date_format — формат строк CSV,
+    некорректные даты становятся NaT), час хранит в int8, объём — в float32,
+    ключевые столбцы (АЗС, топливо, резервуар) — категориями.
+    """
+    df = df.copy()
+    df[date_column] = pd.to_datetime(df[date_column], format=date_format, errors='coerce')
+    df[hour_column] = df[hour_column].astype('int8')
+    df['ds'] = hourly_timestamps(df[date_column], df[hour_column], rollover=rollover)
+    weekday = df['ds'].dt.weekday
+    # При NaT в датах день недели остаётся float — строки с NaT отсеивает вызывающий код
+    df['weekday'] = weekday if weekday.isna().any() else weekday.astype('int8')
+    df[volume_column] = pd.to_numeric(df[volume_column], errors='coerce').astype('float32')
+    for column in key_columns:
+        df[column] = df[column].astype('category')
+    return df
@@ -0,0 +1,148 @@
+# Часовые ряды всех комбинаций в одной матрице NumPy (ряд × час) с заполнением пропусков
+import numpy as np
+import pandas as pd
+
+HOUR = pd.Timedelta(hours=1)
+
+
+def fill_gaps(values, observed):
+    """
+    Заполнение пропусков сразу во всех строках двумерного массива. Внутри ряда — линейная
+    интерполяция между соседними наблюдениями (на часовой сетке совпадает с
+    interpolate(method='time')), до первого и после последнего наблюдения — ближайшее
+    наблюдение, как bfill/ffill. Строки без наблюдений остаются NaN. Возвращает float64.
+    """
+    values = np.asarray(values, dtype='float64')
+    n_rows, n_hours = values.shape
+    positions = np.arange(n_hours)
+
+    # Позиции ближайшего наблюдения слева и справа от каждого часа
+    prev_pos = np.maximum.accumulate(np.where(observed, positions, -1), axis=1)
+    next_pos = np.minimum.accumulate(np.where(observed, positions, n_hours)[:, ::-1], axis=1)[:, ::-1]
+    has_prev, has_next = prev_pos >= 0, next_pos < n_hours
+
+    rows = np.arange(n_rows)[:, None]
+    prev_val = values[rows, np.where(has_prev, prev_pos, 0)]
+    next_val = values[rows, np.where(has_next, next_pos, 0)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Та же формула, что у np.interp: наклон отрезка × смещение от левого узла
+        slope = (next_val - prev_val) / (next_pos - prev_pos)
+        interpolated = slope * (positions - prev_pos) + prev_val
+
+    filled = np.where(
+        has_prev,
+        np.where(has_next, interpolated, prev_val),
+        np.where(has_next, next_val, np.nan)
+    )
+    return np.where(observed, values, filled)
+
+
+class SeriesMatrix:
+    """
+    Часовые продажи комбинаций на общей сетке часов [start, end): values[ряд, час] в float32
+    и observed[ряд, час] — был ли час в данных. Ряды добавляются по мере загрузки (add),
+    пропуски заполняются пачкой строк за один проход (fill), а window отдаёт рабочему
+    потоку срез строки без копирования. start=None — неограниченная история: сетка
+    начинается с самого раннего дня данных и при необходимости расширяется влево.
+    """
+
+    def __init__(self, capacity, start, end):
+        self.end = pd.Timestamp(end).normalize()
+        self.start = pd.Timestamp(start).normalize() if start is not None else self.end
+        self.extendable = start is None
+        self.rows = {}
+        hours = self._position(self.end)
+        self.values = np.full((capacity, hours), np.nan, dtype='float32')
+        self.observed = np.zeros((capacity, hours), dtype=bool)
+
+    def _position(self, timestamp):
+        """Номер часа сетки для метки времени"""
+        return int((pd.Timestamp(timestamp) - self.start) // HOUR)
+
+    def _extend_left(self, new_start):
+        """Сдвигает начало сетки на new_start; уже выданные срезы ссылаются на прежний массив"""
+        extra = self._position(new_start) * -1
+        capacity = self.values.shape[0]
+        self.values = np.hstack([np.full((capacity, extra), np.nan, dtype='float32'), self.values])
+        self.observed = np.hstack([np.zeros((capacity, extra), dtype=bool), self.observed])
+        self.start = new_start
+
+    def _row_for(self, key):
+        """Строка матрицы для комбинации; при нехватке строк матрица удваивается"""
+        if key not in self.rows:
+            capacity, hours = self.values.shape
+            if len(self.rows) == capacity:
+                extra = max(capacity, 1)
+                self.values = np.vstack([self.values, np.full((extra, hours), np.nan, dtype='float32')])
+                self.observed = np.vstack([self.observed, np.zeros((extra, hours), dtype=bool)])
+            self.rows[key] = len(self.rows)
+        return self.rows[key]
+
+    def add(self, key, ds, volumes, summed=False):
+        """
+        Раскладывает историю комбинации по часам сетки; часы вне [start, end) отбрасываются.
+        summed=True — сырые строки: несколько строк одного часа суммируются, NaN считается
+        нулём (как groupby('ds').sum()). Иначе строки уникальны по часу и NaN — пропуск.
+        Возвращает номер строки.
+        """
+        ds = pd.DatetimeIndex(ds)
+        volumes = np.asarray(volumes, dtype='float64')
+        valid = ~ds.isna()
+        ds, volumes = ds[valid], volumes[valid]
+
+        if self.extendable and len(ds):
+            first_day = ds.min().normalize()
+            if first_day < self.start:
+                self._extend_left(first_day)
+
+        row = self._row_for(key)
+        hours = self.values.shape[1]
+        positions = np.asarray((ds - self.start) // HOUR, dtype='int64')
+        keep = (positions >= 0) & (positions < hours)
+        positions, volumes = positions[keep], volumes[keep]
+
+        if summed:
+            totals = np.zeros(hours)
+            np.add.at(totals, positions, np.nan_to_num(volumes))
+            self.values[row, positions] = totals[positions]
+            self.observed[row, positions] = True
+        else:
+            self.values[row, positions] = volumes
+            self.observed[row, positions] = ~np.isnan(volumes)
+        return row
+
+    def fill(self, keys):
+        """Заполняет пропуски в строках комбинаций keys одним векторным проходом"""
+        rows = np.array([self.rows[key] for key in keys], dtype='int64')
+        if rows.size:
+            self.values[rows] = fill_gaps(self.values[rows], self.observed[rows])
+
+    def window(self, key, start, end):
+        """
+        Ряд комбинации для одной даты прогноза: часы [start, end) в границах наблюдений —
+        от полуночи первого дня с данными до полуночи после последнего, как прежний
+        reindex по date_range. Часы до первого и после последнего наблюдения окна берут
+        ближайшее наблюдение окна, а не интерполяцию к соседям за его границами.
+        Возвращает (первый час, значения) или None, если в окне нет наблюдений.
+        """
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        hours = self.values.shape[1]
+        lo = max(self._position(start), 0) if start is not None else 0
+        hi = min(self._position(end), hours)
+        if hi <= lo:
+            return None
+        seen = np.flatnonzero(self.observed[row, lo:hi])
+        if not seen.size:
+            return None
+
+        first, last = lo + seen[0], lo + seen[-1]
+        span_lo = max(first - first % 24, lo)
+        span_hi = min(last - last % 24 + 25, hi)
+        values = self.values[row, span_lo:span_hi]
+        if first > span_lo or last < span_hi - 1:
+            values = values.copy()
+            values[:first - span_lo] = values[first - span_lo]
+            values[last - span_lo + 1:] = values[last - span_lo]
+        return self.start + span_lo * HOUR, values
@@ -0,0 +1,71 @@
+# Профиль запуска: время отложенных импортов и стадий скрипта (--profile-startup)
+import sys
+import time
+import importlib
+import threading
+from contextlib import contextmanager
+
+
+class StartupProfile:
+    """
+    Записывает длительность стадий и тяжёлых импортов. Импорт замеряется только при
+    первой загрузке модуля, вместе с числом подтянутых им модулей — как суммарная
+    (cumulative) колонка python -X importtime, но по крупным зависимостям.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.records = []
+        self._lock = threading.Lock()
+        self._last_checkpoint = self.started
+        self._last_modules = len(sys.modules)
+
+    def _add(self, kind, name, seconds, modules=0):
+        with self._lock:
+            self.records.append((kind, name, seconds, modules))
+
+    def checkpoint(self, name):
+        """Конец стадии name: время и новые модули с предыдущей отметки (удобно для кода уровня модуля)"""
+        now = time.perf_counter()
+        modules = len(sys.modules)
+        self._add('stage', name, now - self._last_checkpoint, modules - self._last_modules)
+        self._last_checkpoint = now
+        self._last_modules = modules
+
+    @contextmanager
+    def stage(self, name):
+        """Замер стадии скрипта"""
+        modules_before = len(sys.modules)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add('stage', name, time.perf_counter() - started, len(sys.modules) - modules_before)
+
+    def import_module(self, name):
+        """
+        Импорт модуля с замером при первой загрузке. importlib дожидается импорта,
+        начатого в другом потоке, поэтому функцию можно звать из фоновых задач.
+        """
+        if name in sys.modules:
+            return importlib.import_module(name)
+        modules_before = len(sys.modules)
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        self._add('import', name, time.perf_counter() - started, len(sys.modules) - modules_before)
+        return module
+
+    def report(self):
+        """Печатает таблицу стадий и импортов, если профиль включён"""
+        if not self.enabled:
+            return
+        total = time.perf_counter() - self.started
+        print("\n⏱️ Профиль запуска (--profile-startup):")
+        print(f"{'тип':<8} {'имя':<40} {'сек':>8} {'доля':>7} {'модулей':>8}")
+        with self._lock:
+            records = list(self.records)
+        for kind, name, seconds, modules in records:
+            share = seconds / total * 100 if total else 0.0
+            print(f"{kind:<8} {name:<40} {seconds:8.3f} {share:6.1f}% {modules:8d}")
+        print(f"{'всего':<8} {'':<40} {total:8.3f}")
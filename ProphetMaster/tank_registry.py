@@ -0,0 +1,65 @@
+# Реестр резервуаров: данные комбинации (OBJECTCODE, TANK, GASNUM) для рабочих потоков без поиска по DataFrame
+
+
+def registry_key(object_code, tank, gasnum):
+    """Ключ реестра (OBJECTCODE, TANK, GASNUM) в едином виде (str, int, str)"""
+    return str(object_code), int(tank), str(gasnum)
+
+
+class TankRecord:
+    """
+    Данные одного резервуара для прогноза. volumes — начальный объём на каждую дату
+    прогноза: (объём, True, если это среднее за 30 дней вместо свежего замера).
+    """
+    __slots__ = ('fuel_name', 'deadstock_volume', 'max_volume', 'volumes')
+
+    def __init__(self, fuel_name, deadstock_volume, max_volume):
+        self.fuel_name = fuel_name
+        self.deadstock_volume = deadstock_volume
+        self.max_volume = max_volume
+        self.volumes = {}
+
+    def initial_volume(self, forecast_date):
+        """(объём, средний ли он) на дату прогноза или (None, False), если объёма нет"""
+        return self.volumes.get(forecast_date, (None, False))
+
+
+class TankRegistry:
+    """
+    Словарь (OBJECTCODE, TANK, GASNUM) -> TankRecord, собранный один раз из строк CSV
+    после фильтров. Рабочие потоки только читают его; объёмы добавляются до запуска
+    прогнозов, поэтому блокировки не нужны.
+    """
+
+    def __init__(self, city_data, fuel_mapping):
+        self.records = {}
+        rows = zip(
+            city_data['OBJECTCODE'], city_data['TANK'], city_data['FuelType'],
+            city_data['Volume_liters'], city_data['Max_Volume']
+        )
+        for object_code, tank, fuel_name, deadstock_volume, max_volume in rows:
+            gasnum = fuel_mapping.get(fuel_name)
+            if gasnum is None:
+                continue
+            # Повторная строка того же резервуара (город и ветка пересекаются) — берём первую
+            self.records.setdefault(
+                registry_key(object_code, tank, gasnum),
+                TankRecord(fuel_name, deadstock_volume, max_volume)
+            )
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, object_code, tank, gasnum):
+        return self.records.get(registry_key(object_code, tank, gasnum))
+
+    def attach_volumes(self, forecast_date, current, fallback):
+        """
+        Начальные объёмы на дату прогноза из словарей volume_lookup
+        {(OBJECTCODE, GASNUM, TANK): VOLUME}; свежий замер важнее среднего.
+        """
+        for volumes, is_fallback in ((fallback, True), (current, False)):
+            for (object_code, gasnum, tank), volume in volumes.items():
+                record = self.get(object_code, tank, gasnum)
+                if record is not None:
+                    record.volumes[forecast_date] = (volume, is_fallback)
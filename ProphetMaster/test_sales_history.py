@@ -0,0 +1,54 @@
+# Кэш истории продаж: запуск с более ранней датой прогноза на уже заполненном кэше
+import sqlite3
+
+import pandas as pd
+
+from data_sources import LocalDataSource
+from sales_history import SalesHistoryStore
+
+HISTORY_DAYS = 16 * 7
+KEYS = [('Z313', '3300000002', 1), ('Z313', '3300000005', 2)]
+
+
+def make_source(base_dir, forecast_date):
+    """Локальный источник с часовыми продажами за 200 дней; начало истории зависит от forecast_date[0]"""
+    def history_start_for(gasnum):
+        return pd.Timestamp(forecast_date[0]) - pd.Timedelta(days=HISTORY_DAYS)
+
+    source = LocalDataSource(str(base_dir), aggregate=True, history_start_for=history_start_for)
+    hours = pd.date_range('2026-03-01', '2026-09-17', freq='h', inclusive='left')
+    rows = [
+        (ts.strftime('%Y-%m-%d'), ts.hour + 1, object_code, gasnum, tank, float(ts.hour))
+        for object_code, gasnum, tank in KEYS
+        for ts in hours
+    ]
+    with sqlite3.connect(str(base_dir / 'sqlserver.sqlite')) as conn:
+        conn.executemany("INSERT INTO ord_salesbyhour VALUES (?, ?, ?, ?, ?, ?)", rows)
+    return source, history_start_for
+
+
+def sync(store, source, history_start_for):
+    """{ключ: история с начала обучающего окна} после синхронизации кэша"""
+    start = history_start_for(None)
+    history = store.sync_iter(KEYS, source.iter_sales, history_start=lambda key: history_start_for(key[1]))
+    return {key: df[df['DATE'] >= start].reset_index(drop=True) for key, df in history}
+
+
+def test_earlier_date_on_warm_cache(tmp_path):
+    forecast_date = [pd.Timestamp('2026-09-17')]
+    source, history_start_for = make_source(tmp_path / 'local_data', forecast_date)
+
+    # Прогрев кэша поздней датой прогноза
+    sync(SalesHistoryStore(str(tmp_path / 'cache')), source, history_start_for)
+
+    # Более ранняя дата требует истории раньше нижней границы кэша
+    forecast_date[0] = pd.Timestamp('2026-09-09')
+    cached = sync(SalesHistoryStore(str(tmp_path / 'cache')), source, history_start_for)
+    uncached = sync(SalesHistoryStore(str(tmp_path / 'fresh')), source, history_start_for)
+
+    assert cached.keys() == uncached.keys() == set(KEYS)
+    for key in KEYS:
+        # Полночь первого дня окна — час 24 накануне, она тоже должна попасть в историю
+        assert cached[key]['DATE'].min() == history_start_for(None)
+        assert cached[key]['R_HOUR'].iloc[0] == 0
+        pd.testing.assert_frame_equal(cached[key], uncached[key])
@@ -0,0 +1,120 @@
+# Профиль продаж по часам недели: скользящее среднее для всех 168 слотов (день недели × час) за один проход
+import numpy as np
+import pandas as pd
+
+HOURS_PER_WEEK = 7 * 24
+HOUR = pd.Timedelta(hours=1)
+
+
+def weekday_hour_profiles(first_hour, values, window=7, empty=np.nan):
+    """
+    Среднее последних window значений каждого слота (день недели, час) для нескольких
+    часовых рядов на одной сетке: values[ряд, час], первый час — first_hour.
+    NaN означает «строки нет»: такой час пропускается, и в среднее идут последние
+    window имеющихся значений слота. Поэтому результат совпадает с
+    rolling(window, min_periods=1).mean().iloc[-1] по строкам одного дня недели и часа
+    без NaN (так выбирал строки прежний find_similar_days), а не по ряду с NaN внутри —
+    там pandas усреднил бы непустые значения среди последних window строк.
+    Считается для всех слотов всех рядов сразу: сетка раскладывается по неделям,
+    и в каждом столбце берутся последние window значений.
+    Возвращает массив [ряд, день недели, час]; слоты без данных получают empty.
+    """
+    values = np.asarray(values, dtype='float64')
+    n_rows, n_hours = values.shape
+    first_hour = pd.Timestamp(first_hour).floor('h')
+
+    # Сдвиг от понедельника 00:00: столбец недели совпадает со слотом weekday * 24 + hour
+    offset = first_hour.weekday() * 24 + first_hour.hour
+    weeks = -(-(offset + n_hours) // HOURS_PER_WEEK)
+    grid = np.full((n_rows, weeks * HOURS_PER_WEEK), np.nan)
+    grid[:, offset:offset + n_hours] = values
+    grid = grid.reshape(n_rows, weeks, HOURS_PER_WEEK)
+
+    # Номер значения внутри слота, считая с конца: 1 — самое свежее
+    valid = ~np.isnan(grid)
+    rank = np.cumsum(valid[:, ::-1], axis=1)[:, ::-1]
+    recent = valid & (rank <= window)
+    count = recent.sum(axis=1)
+    total = np.where(recent, grid, 0.0).sum(axis=1)
+
+    profile = np.full(count.shape, empty, dtype='float64')
+    np.divide(total, count, out=profile, where=count > 0)
+    return profile.reshape(n_rows, 7, 24)
+
+
+def weekday_hour_profile(ds, values, window=7, empty=np.nan):
+    """
+    Профиль [день недели, час] одного ряда с метками ds (пропуски часов и порядок строк
+    не важны; при повторе часа берётся последняя строка). См. weekday_hour_profiles.
+    """
+    ds = pd.DatetimeIndex(ds)
+    values = np.asarray(values, dtype='float64')
+    if not len(ds):
+        return np.full((7, 24), empty, dtype='float64')
+    first_hour = ds.min().floor('h')
+    positions = np.asarray((ds.floor('h') - first_hour) // HOUR, dtype='int64')
+    series = np.full((1, positions.max() + 1), np.nan)
+    series[0, positions] = values
+    return weekday_hour_profiles(first_hour, series, window=window, empty=empty)[0]
+
+
+def extend_until_deadstock(first_hour, start_volume, dead_stock, profile, max_hours=None):
+    """
+    Продление прогноза по профилю [день недели, час] с first_hour, пока объём start_volume,
+    уменьшаясь каждый час на значение слота, не опустится до dead_stock.
+    Профиль раскладывается на неделю вперёд и суммируется один раз (cumsum); час
+    пересечения находится searchsorted по накопленному максимуму расхода, а целые недели
+    до него пропускаются арифметикой, поэтому горизонт max_hours может быть любым.
+    Возвращает (ds, расход, объём, достигнут ли мёртвый остаток) для часов до пересечения
+    включительно. Без пересечения — max_hours часов, а если он не задан и недельный
+    расход не положителен (остаток не будет достигнут никогда) — одна неделя.
+    """
+    first_hour = pd.Timestamp(first_hour)
+    slots = np.asarray(profile, dtype='float64').reshape(HOURS_PER_WEEK)
+    offset = first_hour.weekday() * 24 + first_hour.hour
+    week = np.roll(slots, -offset)
+    peak = np.maximum.accumulate(np.cumsum(week))
+    weekly = week.sum()
+    need = start_volume - dead_stock
+
+    hours = None
+    if need <= 0:
+        hours = 0
+    elif peak[-1] >= need or weekly > 0:
+        # Целые недели, после которых максимум расхода за неделю покрывает need
+        weeks = 0 if peak[-1] >= need else int(np.ceil((need - peak[-1]) / weekly))
+        position = np.searchsorted(peak, need - weeks * weekly)
+        while position == HOURS_PER_WEEK:
+            # Поправка на округление при делении на недельный расход
+            weeks += 1
+            position = np.searchsorted(peak, need - weeks * weekly)
+        hours = weeks * HOURS_PER_WEEK + int(position) + 1
+
+    reached = hours is not None and (max_hours is None or hours <= max_hours)
+    if not reached:
+        hours = max_hours if max_hours is not None else HOURS_PER_WEEK
+
+    consumption = slots[(offset + np.arange(hours)) % HOURS_PER_WEEK]
+    ds = pd.date_range(start=first_hour, periods=hours, freq='h')
+    return ds, consumption, start_volume - np.cumsum(consumption), reached
+
+
+def series_profiles(series, window=7, empty=np.nan):
+    """
+    Профили для списка рядов (первый час, значения) с разным началом и длиной: ряды
+    укладываются на общую часовую сетку и считаются одним вызовом weekday_hour_profiles.
+    Для None в списке возвращается None.
+    """
+    present = [s for s in series if s is not None]
+    if not present:
+        return [None] * len(series)
+    start = min(pd.Timestamp(first_hour).floor('h') for first_hour, _ in present)
+    bounds = [
+        (int((pd.Timestamp(first_hour).floor('h') - start) // HOUR), len(values))
+        for first_hour, values in present
+    ]
+    grid = np.full((len(present), max(lo + length for lo, length in bounds)), np.nan)
+    for row, ((_, values), (lo, length)) in enumerate(zip(present, bounds)):
+        grid[row, lo:lo + length] = values
+    profiles = iter(weekday_hour_profiles(start, grid, window=window, empty=empty))
+    return [next(profiles) if s is not None else None for s in series]